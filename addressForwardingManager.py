@@ -1,7 +1,6 @@
 import os
 import time
 import logging
-import requests
 
 from threading import Thread
 
@@ -15,6 +14,7 @@ class AddressForwardingWorker(Thread):
         self.timer = timer
 
     def run(self):
+        import requests
         counter = 0
         while self.caller.flag:
             if counter >= self.timer:
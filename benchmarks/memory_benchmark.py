@@ -0,0 +1,61 @@
+"""
+Memory benchmark: memory taken by the session library held as pydantic models and as compact records
+(data_handlers/compact.py, as SessionsHandler holds it), on a generated library.
+
+Run from the repository root:
+python benchmarks/memory_benchmark.py --sizes 100 500 --items 10
+
+Memory is measured with tracemalloc after loading the sessions from storage, the loaded JSON itself not counted.
+Also reported is the time to expand every record back into a model, the cost of serving all sessions.
+"""
+import os
+import gc
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+from startup_benchmark import generate_library
+from data_handlers.session import Session
+from data_handlers.storage import JSONSessionStore, load_model
+from data_handlers.compact import compact, expand
+
+
+# Bytes allocated by build() and still held by what it returns
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500], help="Sessions per library")
+    parser.add_argument("--items", type=int, default=10, help="Questions per session, each with two actions")
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'models (MB)':>12} {'records (MB)':>13} {'expand all (s)':>15}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            generate_library(folder, size, args.items)
+            data = JSONSessionStore(os.path.join(folder, "data", "sessions")).load_all()
+        models_size, models = measure(lambda: [load_model(Session, session) for session in data])
+        del models
+        records_size, records = measure(lambda: [compact(load_model(Session, session)) for session in data])
+        start = time.perf_counter()
+        for record in records:
+            expand(record)
+        expand_time = time.perf_counter() - start
+        print(f"{size:>6} {models_size / 2 ** 20:>12.1f} {records_size / 2 ** 20:>13.1f} {expand_time:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Startup time benchmark: times importing main (loading all data and creating the handlers) on generated libraries
+of increasing size, with trusted loading (TRUSTED_LOAD = True) and with full validation.
+
+Run from the repository root:
+python benchmarks/startup_benchmark.py --sizes 10 100 1000 --items 10
+
+Each library is generated in a temporary folder, every measurement is the best of --repeat fresh processes
+(after one warm-up start, which also performs the JSON to SQLite migration with --engine sqlite).
+With --working-set, only session summaries are loaded at startup (see SESSION_WORKING_SET in config.py).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+from uuid import uuid4
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# main is imported within an event loop, as under uvicorn (the Pepper connection manager schedules a task)
+STARTUP = """
+import time
+import asyncio
+start = time.perf_counter()
+
+
+async def load():
+    import config
+    config.TRUSTED_LOAD = {trusted}
+    config.STORAGE_ENGINE = "{engine}"
+    config.SESSION_WORKING_SET = {working_set}
+    import main
+
+asyncio.run(load())
+print(time.perf_counter() - start)
+"""
+
+
+def generate_action(index):
+    def child(**fields):
+        return {"ID": str(uuid4()), "Group": "", "PrimaryAction": False, "Delay": 0, **fields}
+    return {"ID": str(uuid4()), "Group": "", "PrimaryAction": index == 0, "Name": None,
+            "UtteranceItem": child(Phrase=f"Lause number {index}", Pronunciation=None, FilePath="", Speed=1.0),
+            "MotionItem": child(Name="", FilePath=""),
+            "ImageItem": child(Name="", FilePath=""),
+            "URLItem": child(Name="", URL="")}
+
+
+def generate_library(folder, size, items):
+    os.makedirs(os.path.join(folder, "data", "sessions"))
+    index = {}
+    for number in range(size):
+        session = {"ID": str(uuid4()),
+                   "Name": f"Sessioon {number}",
+                   "Description": "Startup benchmark",
+                   "Items": [{"ID": str(uuid4()), "Actions": [generate_action(0), generate_action(1)]}
+                             for _ in range(items)]}
+        with open(os.path.join(folder, "data", "sessions", f"{session['ID']}.json"), "w") as f:
+            json.dump(session, f)
+        index[session['ID']] = {"Name": session['Name'], "Description": session['Description'],
+                                "ItemCount": items, "Modified": time.time(), "Media": [],
+                                "Items": [session_item['ID'] for session_item in session['Items']],
+                                "Actions": [action['ID'] for session_item in session['Items']
+                                            for action in session_item['Actions']]}
+    with open(os.path.join(folder, "data", "sessions", "index.json"), "w") as f:
+        json.dump({"sessions": index}, f)
+
+    shortcuts = [generate_action(index) for index in range(size)]
+    with open(os.path.join(folder, "data", "action_shortcuts.json"), "w") as f:
+        json.dump({"action_shortcuts": shortcuts}, f)
+    with open(os.path.join(folder, "data", "audio_shortcuts.json"), "w") as f:
+        json.dump({"audio_shortcuts": [action["UtteranceItem"] for action in shortcuts]}, f)
+
+
+def time_startup(folder, trusted, engine, working_set):
+    result = subprocess.run([sys.executable, "-c", STARTUP.format(trusted=trusted, engine=engine,
+                                                                  working_set=working_set)],
+                            cwd=folder, env={**os.environ, "PYTHONPATH": REPOSITORY},
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500, 1000],
+                        help="Sessions (and shortcuts) per library")
+    parser.add_argument("--items", type=int, default=10, help="Questions per session, each with two actions")
+    parser.add_argument("--repeat", type=int, default=3, help="Starts per measurement, the best one is reported")
+    parser.add_argument("--engine", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--working-set", type=int, default=0,
+                        help="SESSION_WORKING_SET, 0 loads every session at startup")
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'trusted (s)':>12} {'validated (s)':>14}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            generate_library(folder, size, args.items)
+            time_startup(folder, True, args.engine, args.working_set)
+            trusted = min(time_startup(folder, True, args.engine, args.working_set) for _ in range(args.repeat))
+            validated = min(time_startup(folder, False, args.engine, args.working_set) for _ in range(args.repeat))
+        print(f"{size:>6} {trusted:>12.3f} {validated:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Synthesis throughput benchmark: times /api/synthesis/batch on generated sessions of increasing size.
+
+Run against a backend whose TTS_ENDPOINT points to the local stand-in (see neurokoneStub.py):
+uvicorn neurokoneStub:app --port 8099
+uvicorn main:app --port 8080
+python benchmarks/synthesis_benchmark.py --sizes 1 10 40 --latency 0.5
+
+Each size is synthesized twice: "cold" with fresh phrases, "warm" with the same phrases again (cache hits).
+The generated sessions are removed afterwards, their audio files remain in data/uploads.
+"""
+import time
+import argparse
+import requests
+
+from uuid import uuid4
+
+
+def generate_session(name, size, nonce):
+    def action(phrase):
+        return {"UtteranceItem": {"Phrase": phrase, "Delay": 0, "FilePath": ""},
+                "MotionItem": {"Name": "", "FilePath": "", "Delay": 0},
+                "ImageItem": {"Name": "", "FilePath": "", "Delay": 0},
+                "URLItem": {"Name": "", "URL": "", "Delay": 0}}
+    return {"Name": name,
+            "Description": "Synthesis benchmark",
+            "Items": [{"Actions": [action(f"Lause number {index} ({nonce})")]} for index in range(size)]}
+
+
+def run_size(server, size, voice):
+    name = f"benchmark-{uuid4()}"
+    # Saved empty first, saving the phrases would already queue their synthesis in the background
+    requests.post(f"{server}/api/sessions/", json=generate_session(name, 0, "")).raise_for_status()
+    session_id = next(x for x in requests.get(f"{server}/api/sessions/").json()['sessions'] if x['Name'] == name)['ID']
+    session = {**generate_session(name, size, uuid4().hex[:8]), "ID": session_id}
+
+    timings = []
+    try:
+        for _ in ["cold", "warm"]:
+            start = time.perf_counter()
+            r = requests.post(f"{server}/api/synthesis/batch", params={"voice": voice}, json=session)
+            timings.append(time.perf_counter() - start)
+            r.raise_for_status()
+            if 'error' in r.json():
+                raise RuntimeError(r.json()['error'])
+    finally:
+        requests.delete(f"{server}/api/sessions/{session_id}")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="http://127.0.0.1:8080", help="Backend address")
+    parser.add_argument("--stub", default="http://127.0.0.1:8099", help="Neurokõne stand-in address")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 5, 10, 20, 40], help="Utterances per session")
+    parser.add_argument("--latency", type=float, default=None, help="Stand-in latency per request in seconds")
+    parser.add_argument("--error-rate", type=float, default=None, help="Share of stand-in requests failing")
+    parser.add_argument("--voice", default="Luukas")
+    args = parser.parse_args()
+
+    if args.latency is not None or args.error_rate is not None:
+        requests.post(f"{args.stub}/settings", json={"latency": args.latency,
+                                                     "error_rate": args.error_rate}).raise_for_status()
+
+    print(f"{'size':>6} {'cold (s)':>10} {'warm (s)':>10} {'phrases/s':>10}")
+    for size in args.sizes:
+        cold, warm = run_size(args.server, size, args.voice)
+        print(f"{size:>6} {cold:>10.3f} {warm:>10.3f} {size / cold:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
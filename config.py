@@ -23,10 +23,68 @@ RECORDING_SIZE_LIMIT = 5
 
 # Speech synthesis via Neurokõne
 
+# Neurokõne text-to-speech endpoint. For offline testing, point this to the local stand-in, e.g.
+# "http://127.0.0.1:8099/text-to-speech/v2" (see neurokoneStub.py)
+TTS_ENDPOINT = "https://api.tartunlp.ai/text-to-speech/v2"
 # List of strings representing neurokõne speakers
 SPEAKERS = ['Luukas', 'Lee']
 # String identifying the default speaker
 SPEAKER = 'Luukas'
+# Number of phrases synthesized in parallel during batch synthesis
+SYNTHESIS_WORKERS = 4
+# Seconds to wait for a Neurokõne response before giving up on a phrase
+SYNTHESIS_TIMEOUT = 60
+
+
+# Robot audio
+
+# Uploaded and synthesized WAV files are converted to mono at this sample rate before being sent to the robot
+ROBOT_AUDIO_SAMPLE_RATE = 22050
+# Loudness normalisation targets for converted audio (fractions of full scale), the peak limit takes precedence
+ROBOT_AUDIO_RMS = 0.1
+ROBOT_AUDIO_PEAK = 0.89
+
+
+# Tablet images
+
+# Uploaded images are scaled down to fit Pepper's tablet screen (width, height) before being shown
+TABLET_IMAGE_SIZE = (1280, 800)
+# Size of image previews for the web client
+THUMBNAIL_SIZE = (320, 200)
+# JPEG quality of the scaled images
+IMAGE_QUALITY = 85
+
+
+# Media storage
+
+# Uploaded files no session or shortcut refers to are moved to data/trash by the garbage collection
+# (on shutdown and via /api/media/gc). Files modified within the grace period (in hours) are left alone,
+# files are deleted from the trash after the retention period (in days).
+MEDIA_GC_GRACE_PERIOD = 24
+MEDIA_TRASH_RETENTION = 7
+# Seconds clients (the robot, browsers) may cache images served from data/uploads without checking back.
+# Images are named by their content hash and don't change. Audio is always revalidated, re-synthesized speech (force)
+# replaces its file in place.
+MEDIA_CACHE_MAX_AGE = 31536000
+
+
+# Persistence
+
+# Where sessions, shortcuts and motions are stored: "json" (files under data/) or "sqlite" (data/pepper.db).
+# On the first start with "sqlite", the JSON files are imported into the database (and left as they are).
+STORAGE_ENGINE = "json"
+
+# Changes to sessions, shortcuts and motions are written to disk in the background,
+# at most once per this many seconds (and on shutdown)
+PERSISTENCE_INTERVAL = 2
+
+# Sessions, shortcuts and motions saved by this server are loaded without validation for a faster startup.
+# Set to False if the saved files have been edited by hand.
+TRUSTED_LOAD = True
+
+# Sessions kept in memory. 0 keeps all of them; otherwise only the names, descriptions etc. of all sessions are kept,
+# along with up to this many recently opened sessions, others being read from storage when they're needed.
+SESSION_WORKING_SET = 0
 
 
 # Redirection
@@ -1,15 +1,20 @@
 import os
 import json
 from uuid import UUID, uuid4
+from threading import Lock
 from base64 import b64encode, urlsafe_b64encode
 from aiofiles import open as async_open
 from urllib.parse import urlparse, parse_qs
 
+from typing import Literal
 from pydantic import BaseModel
 from pydantic.schema import Optional
 from fastapi.encoders import jsonable_encoder
 
-from .file_operations import hash_phrase_to_filename, hash_file_to_filename
+from .file_operations import hash_phrase_to_filename, hash_file_to_filename, store_as
+from .variants import robot_audio, tablet_image
+from .storage import load_model
+from .compact import Record, expand
 
 
 class Action(BaseModel):
@@ -60,8 +65,9 @@ class UtteranceItem(SingleAction):
         # Double-check for actual audio to play
         if self.FilePath is None:
             raise NotImplementedError
+        # The robot is sent the converted copy of the file (created on first use for older files)
         return {"command": "say",
-                "content": encode_url(self.FilePath),
+                "content": encode_url(robot_audio(self.FilePath)),
                 "name": self.Phrase,
                 "delay": self.Delay,
                 "id": str(self.ID)}
@@ -73,6 +79,12 @@ class UtteranceItem(SingleAction):
         if self.Pronunciation == self.Phrase:
             self.Pronunciation = ""
 
+    # The text sent to the synthesizer, the pronunciation overrides the phrase if it differs
+    def synthesis_phrase(self):
+        if self.Pronunciation and self.Pronunciation != self.Phrase:
+            return self.Pronunciation
+        return self.Phrase
+
 
 class ImageItem(SingleAction):
     Name: str
@@ -84,7 +96,8 @@ class ImageItem(SingleAction):
         self.FilePath = ""
 
     def get_command_payload(self):
-        with open(self.FilePath, "rb") as image:
+        # The tablet is sent a copy scaled to its screen (created on first use for older files)
+        with open(tablet_image(self.FilePath), "rb") as image:
             return {"command": "show_image",
                     "content": b64encode(image.read()).decode(),
                     "name": self.Name,
@@ -182,6 +195,10 @@ class MultiAction(Action):
         else:
             return "CMD", self.ID
 
+    # Uploaded files used by this action
+    def get_media_paths(self):
+        return [child.FilePath for child in [self.UtteranceItem, self.ImageItem] if child and child.FilePath]
+
     def get_children(self, must_be_valid=False):
         children = []
         if self.UtteranceItem is not None and self.UtteranceItem.ID is not None:
@@ -199,6 +216,14 @@ class MultiAction(Action):
         return children
 
 
+# A change to the action shortcuts (see ActionShortcutsHandler.apply_operations): create Action (with a new ID),
+# update the shortcut with the ID of Action, or delete the shortcut ID
+class ShortcutOperation(BaseModel):
+    Op: Literal['create', 'update', 'delete']
+    ID: UUID = None
+    Action: Optional[MultiAction]
+
+
 def initialise_child_ids(action: MultiAction):
     zero = UUID('00000000-0000-0000-0000-000000000000')
     # If ID-less child actions exist, grant them IDs
@@ -212,6 +237,22 @@ def initialise_child_ids(action: MultiAction):
         action.URLItem.ID = uuid4()
 
 
+# Searchable texts of a MultiAction or an UtteranceItem, or of their records (see search.py):
+# group, names, phrase and pronunciation
+def action_texts(action):
+    texts = [action.Group]
+    for item in [action, getattr(action, 'UtteranceItem', None), getattr(action, 'ImageItem', None),
+                 getattr(action, 'MotionItem', None)]:
+        if item is not None:
+            texts += [getattr(item, 'Name', None), getattr(item, 'Phrase', None), getattr(item, 'Pronunciation', None)]
+    return texts
+
+
+def action_phrase(action):
+    utterance = getattr(action, 'UtteranceItem', action)
+    return getattr(utterance, 'Phrase', None) if utterance is not None else None
+
+
 def _name_is_uuid(filepath):
     is_uuid = True
     try:
@@ -226,95 +267,251 @@ async def rename_files(action: MultiAction):
         if not action.UtteranceItem.Phrase:
             raise ValueError(f"Corrupted session file - missing phrase for {action.UtteranceItem.FilePath}")
         new_utterance_path = os.path.join('data', 'uploads', f"{hash_phrase_to_filename(action.UtteranceItem.Phrase)}.{action.UtteranceItem.FilePath.rsplit('.', 1)[-1]}")
-        os.rename(action.UtteranceItem.FilePath, new_utterance_path)
-        action.UtteranceItem.FilePath = new_utterance_path
+        action.UtteranceItem.FilePath = store_as(action.UtteranceItem.FilePath, new_utterance_path)
     if action.ImageItem and action.ImageItem.FilePath and _name_is_uuid(action.ImageItem.FilePath):
         async with async_open(action.ImageItem.FilePath, "rb") as image_file:
             file_hash = await hash_file_to_filename(image_file)
         new_image_path = os.path.join('data', 'uploads', f"{file_hash}.{action.ImageItem.FilePath.rsplit('.', 1)[-1]}")
-        os.rename(action.ImageItem.FilePath, new_image_path)
-        action.ImageItem.FilePath = new_image_path
+        action.ImageItem.FilePath = store_as(action.ImageItem.FilePath, new_image_path)
     return action
 
 
 class ActionShortcutsHandler:
-    def __init__(self, quick_actions_file, actions_handler, motions_handler):
+    def __init__(self, action_store, actions_handler, motions_handler, media_handler, persistence_manager,
+                 change_tracker, search_index):
         self.actions_master = actions_handler
         self.motions_master = motions_handler
+        self.media_master = media_handler
+        self.persistence = persistence_manager
+        self.changes = change_tracker
+        self.search = search_index
+        self.store = action_store
+        # Held while the shortcuts change, bulk operations hold it from checking them until they're applied
+        self.lock = Lock()
 
-        with open(quick_actions_file) as f:
-            actions_list = json.load(f)['action_shortcuts']
+        actions_list = self.store.load()
 
         self.actions = []
+        # Shortcut ID -> shortcut, in the order of self.actions
+        self.action_ids = dict()
         for action in actions_list:
-            multiaction = MultiAction.parse_obj(action)
+            multiaction = load_model(MultiAction, action)
             self.actions.append(multiaction)
-            self.actions_master.add_action(multiaction)
-            for child_action in multiaction.get_children(must_be_valid=True):
-                self.actions_master.add_action(child_action)
+            self.action_ids[multiaction.ID] = multiaction
+            self._register_actions(multiaction)
+            self._index_action(multiaction)
+            self.media_master.set_references(multiaction.ID, multiaction.get_media_paths())
+
+    def _register_actions(self, multiaction):
+        self.actions_master.set_actions(multiaction.ID, [multiaction, *multiaction.get_children(must_be_valid=True)])
 
-    def _save_actions(self):
-        with open("data/action_shortcuts.json", "w") as f:
-            f.write(json.dumps(jsonable_encoder(self.get_actions())))
+    def _index_action(self, action):
+        hit = {"ID": action.ID, "Collection": "action_shortcuts", "Name": getattr(action, 'Name', None),
+               "Group": action.Group, "Phrase": action_phrase(action)}
+        self.search.set_documents(action.ID, [("actions", hit, action_texts(action))])
+
+    def _write_actions(self):
+        self.store.save(self.actions)
+
+    def _save_actions(self, durable=False):
+        self.persistence.mark_dirty(self.store, self._write_actions, durable)
 
     def get_actions(self):
         return {"action_shortcuts": self.actions}
 
+    def get_action(self, action_id):
+        return self.action_ids.get(action_id)
+
+    def check_indexes(self):
+        if self.action_ids != {action.ID: action for action in self.actions}:
+            return ["The action shortcut ID index doesn't match the action shortcuts"]
+        return []
+
     def add_action(self, multiaction):
         multiaction.ID = uuid4()
-        initialise_child_ids(multiaction)
-        self.actions.append(multiaction)
-        self.actions_master.add_action(multiaction)
-        if multiaction.MotionItem and multiaction.MotionItem.Name:
-            multiaction.MotionItem.attribute_correction(self.motions_master)
-        for child_action in multiaction.get_children(must_be_valid=True):
-            self.actions_master.add_action(child_action)
-        self._save_actions()
+        return self.import_action(multiaction)
+
+    # Add a shortcut keeping its ID (e.g. when importing a library)
+    def import_action(self, multiaction):
+        with self.lock:
+            self._add_action(multiaction)
+            self.actions.append(multiaction)
+            self._save_actions()
         return {"message": "Shortcut created!"}
 
     def update_action(self, action):
-        for index, listed_action in enumerate(self.actions):
-            if listed_action.ID == action.ID:
-                break
-        else:
-            return {"error": f"Shortcut {action.ID} was not found!"}
-
-        self.actions[index] = action
-        self._save_actions()
-        self.actions_master.add_action(action, overwrite=True)
-        if type(action).__name__ == 'MultiAction':
-            for child_action in action.get_children():
-                self.actions_master.add_action(child_action, overwrite=True)
+        with self.lock:
+            if action.ID not in self.action_ids:
+                return {"error": f"Shortcut {action.ID} was not found!"}
+            self._update_action(action)
+            self.actions = list(self.action_ids.values())
+            self._save_actions()
         return {"message": "Shortcut updated!"}
 
     def remove_action(self, action_id):
-        for index, listed_action in enumerate(self.actions):
-            if listed_action.ID == action_id:
-                self.actions_master.remove_action(action_id)
-                if type(self.actions[index]).__name__ == 'MultiAction':
-                    for child_action in self.actions[index].get_children():
-                        self.actions_master.remove_action(child_action.ID)
-                self.actions.pop(index)
-                self._save_actions()
-                return {"message": "Shortcut deleted!"}
-        return {"error": f"Shortcut {action_id} was not found!"}
-
-
-# TODO: Should actions be removed from this handler when removed elsewhere?
+        with self.lock:
+            if action_id not in self.action_ids:
+                return {"error": f"Shortcut {action_id} was not found!"}
+            self._remove_action(action_id)
+            self.actions = list(self.action_ids.values())
+            self._save_actions()
+        return {"message": "Shortcut deleted!"}
+
+    # Error message of the first operation (see ShortcutOperation) that can't be applied after the ones before it,
+    # None if all of them can. check_operations() and apply_operations() are called with self.lock held.
+    def check_operations(self, operations):
+        ids = set(self.action_ids)
+        for number, operation in enumerate(operations):
+            if operation.Op == 'create':
+                if operation.Action is None:
+                    return f"Action shortcut operation {number}: an Action is required!"
+            elif operation.Op == 'update':
+                if operation.Action is None or operation.Action.ID not in ids:
+                    return f"Action shortcut operation {number}: an Action of an existing shortcut is required!"
+            elif operation.ID not in ids:
+                return f"Action shortcut operation {number}: shortcut {operation.ID} was not found!"
+            else:
+                ids.discard(operation.ID)
+        return None
+
+    # Apply operations that passed check_operations(), the shortcuts are written once. Returns the IDs of the
+    # created shortcuts.
+    def apply_operations(self, operations):
+        created = []
+        for operation in operations:
+            if operation.Op == 'create':
+                operation.Action.ID = uuid4()
+                self._add_action(operation.Action)
+                created.append(operation.Action.ID)
+            elif operation.Op == 'update':
+                self._update_action(operation.Action)
+            else:
+                self._remove_action(operation.ID)
+        if operations:
+            self.actions = list(self.action_ids.values())
+            self._save_actions()
+        return created
+
+    # The _add, _update and _remove methods change self.action_ids (not self.actions) and the indexes, leaving
+    # updating self.actions and saving to their callers
+    def _add_action(self, multiaction):
+        if multiaction.ID is None:
+            multiaction.ID = uuid4()
+        initialise_child_ids(multiaction)
+        self.action_ids[multiaction.ID] = multiaction
+        if multiaction.MotionItem and multiaction.MotionItem.Name:
+            multiaction.MotionItem.attribute_correction(self.motions_master)
+        self._register_actions(multiaction)
+        self._index_action(multiaction)
+        self.media_master.set_references(multiaction.ID, multiaction.get_media_paths())
+        self.changes.changed('action_shortcuts', multiaction.ID)
+
+    def _update_action(self, action):
+        self.action_ids[action.ID] = action
+        self.media_master.set_references(action.ID, action.get_media_paths())
+        self.changes.changed('action_shortcuts', action.ID)
+        if type(action).__name__ == 'MultiAction':
+            self.actions_master.set_actions(action.ID, [action, *action.get_children()])
+        else:
+            self.actions_master.set_actions(action.ID, [action])
+        self._index_action(action)
+
+    def _remove_action(self, action_id):
+        del self.action_ids[action_id]
+        self.actions_master.release(action_id)
+        self.search.release(action_id)
+        self.media_master.release(action_id)
+        self.changes.removed('action_shortcuts', action_id)
+
+
+# Registry of the actions Pepper can be asked to perform, by ID.
+# Sessions, shortcuts and the motions list ("owners") register their complete set of actions on every change, an
+# action is dropped once no owner has it any more. Owners may share IDs (e.g. session motions link to the motions list),
+# the registered object is then that of one of the owners still having it.
 class ActionsHandler:
     def __init__(self):
+        self.lock = Lock()
+        # Action ID -> action
         self.actions = dict()
+        # Owner ID -> {action ID: action}
+        self.owned = dict()
+        # Action ID -> set of owner IDs
+        self.owners = dict()
+        # Registers the owner of an action that isn't registered yet if it has one, see set_loader
+        self.loader = None
+
+    def set_actions(self, owner_id, actions):
+        with self.lock:
+            self._set_actions(owner_id, self._by_id(actions))
+
+    # Register further actions for the owner, keeping those it already has except the removed IDs
+    def add_actions(self, owner_id, actions, removed=()):
+        with self.lock:
+            owned = {action_id: action for action_id, action in self.owned.get(owner_id, {}).items()
+                     if action_id not in removed}
+            self._set_actions(owner_id, {**owned, **self._by_id(actions)})
+
+    @staticmethod
+    def _by_id(actions):
+        return {action.ID: action for action in actions if action is not None and action.ID is not None}
+
+    def _set_actions(self, owner_id, actions):
+        for action_id in self.owned.get(owner_id, {}).keys() - actions.keys():
+            self._unreference(owner_id, action_id)
+        for action_id, action in actions.items():
+            self.actions[action_id] = action
+            self.owners.setdefault(action_id, set()).add(owner_id)
+        if actions:
+            self.owned[owner_id] = actions
+        else:
+            self.owned.pop(owner_id, None)
+
+    def release(self, owner_id):
+        with self.lock:
+            for action_id in self.owned.pop(owner_id, {}):
+                self._unreference(owner_id, action_id)
+
+    def _unreference(self, owner_id, action_id):
+        owners = self.owners.get(action_id, set())
+        owners.discard(owner_id)
+        if owners:
+            self.actions[action_id] = self.owned[next(iter(owners))][action_id]
+        else:
+            self.owners.pop(action_id, None)
+            self.actions.pop(action_id, None)
 
-    def add_action(self, action, overwrite=False):
-        if action.ID not in self.actions.keys() or overwrite:
-            self.actions[action.ID] = action
-
-    def add_actions(self, actions):
-        for action in actions:
-            self.add_action(action)
+    # IDs of the owners having the action
+    def get_owners(self, action_id):
+        with self.lock:
+            return set(self.owners.get(action_id, ()))
 
+    # Sessions register records of their actions (see compact.py), those are expanded into models
     def get_action(self, action_id: UUID):
-        return self.actions[action_id] if action_id in self.actions.keys() else None
-
-    def remove_action(self, action_id):
-        self.actions.pop(action_id, None)
+        action = self.actions.get(action_id)
+        return expand(action) if isinstance(action, Record) else action
+
+    # Owners that don't keep all of their actions registered (sessions outside the working set) set a loader, called
+    # with the ID of an action that isn't registered. It registers the actions of its owner, if there is one.
+    def set_loader(self, loader):
+        self.loader = loader
+
+    # get_action(), registering the action through the loader if it isn't registered. It may read from storage.
+    def load_action(self, action_id: UUID):
+        if action_id not in self.actions and self.loader is not None:
+            self.loader(action_id)
+        return self.get_action(action_id)
+
+    def get_statistics(self):
+        return {'actions': len(self.actions), 'owners': len(self.owned)}
+
+    def check_indexes(self):
+        errors = []
+        owners = dict()
+        for owner_id, actions in self.owned.items():
+            for action_id in actions:
+                owners.setdefault(action_id, set()).add(owner_id)
+        if owners != self.owners:
+            errors.append("The action owners don't match the actions registered by them")
+        if self.actions.keys() != self.owners.keys():
+            errors.append("The action registry has actions without owners")
+        return errors
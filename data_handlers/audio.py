@@ -1,32 +1,128 @@
-import json
-from data_handlers.action import UtteranceItem
-from fastapi.encoders import jsonable_encoder
+from uuid import UUID, uuid4
+from threading import Lock
+from typing import Literal
+from pydantic import BaseModel
+from pydantic.schema import Optional
+
+from data_handlers.action import UtteranceItem, action_texts
+from data_handlers.storage import load_model
+
+
+# A change to the audio shortcuts (see AudioShortcutsHandler.apply_operations): create Audio (its file uploaded
+# beforehand, see /api/upload/audio), update the shortcut with the ID of Audio, or delete the shortcut ID
+class AudioShortcutOperation(BaseModel):
+    Op: Literal['create', 'update', 'delete']
+    ID: UUID = None
+    Audio: Optional[UtteranceItem]
 
 
 class AudioShortcutsHandler:
-    def __init__(self, audio_file, actions_master):
-        with open(audio_file) as f:
-            audio_list = json.load(f)['audio_shortcuts']
+    def __init__(self, audio_store, actions_master, media_master, persistence_manager, change_tracker, search_index):
+        self.actions_master = actions_master
+        self.media_master = media_master
+        self.persistence = persistence_manager
+        self.changes = change_tracker
+        self.search = search_index
+        self.store = audio_store
+        # Held while the shortcuts change, bulk operations hold it from checking them until they're applied
+        self.lock = Lock()
+        audio_list = self.store.load()
 
-        self.audio_items = [UtteranceItem.parse_obj(audio_item) for audio_item in audio_list]
-        actions_master.add_actions(self.audio_items)
+        self.audio_items = [load_model(UtteranceItem, audio_item) for audio_item in audio_list]
+        # Audio ID -> item
+        self.audio_ids = {audio_item.ID: audio_item for audio_item in self.audio_items}
+        for audio_item in self.audio_items:
+            self.actions_master.set_actions(audio_item.ID, [audio_item])
+            self._index_audio(audio_item)
+            self.media_master.set_references(audio_item.ID, [audio_item.FilePath])
 
     def get_audio_metadata(self):
         return {'audio_shortcuts': self.audio_items}
 
+    def get_audio(self, ID):
+        return self.audio_ids.get(ID)
+
     def get_single_audio_metadata(self, ID):
-        return {'audio_shortcuts': next((x for x in self.audio_items if x.ID == ID), None)}
+        return {'audio_shortcuts': self.get_audio(ID)}
+
+    def check_indexes(self):
+        if self.audio_ids != {audio_item.ID: audio_item for audio_item in self.audio_items}:
+            return ["The audio ID index doesn't match the audio shortcuts"]
+        return []
+
+    def _index_audio(self, audio_item):
+        hit = {"ID": audio_item.ID, "Collection": "audio_shortcuts", "Group": audio_item.Group,
+               "Phrase": audio_item.Phrase}
+        self.search.set_documents(audio_item.ID, [("actions", hit, action_texts(audio_item))])
 
-    def _save_audio_metadata(self):
-        with open("data/audio_shortcuts.json", "w") as f:
-            f.write(json.dumps(jsonable_encoder(self.get_audio_metadata())))
-            print(f"saved:\n{self.get_audio_metadata()}")
+    def _write_audio_metadata(self):
+        self.store.save(self.audio_items)
+
+    def _save_audio_metadata(self, durable=False):
+        self.persistence.mark_dirty(self.store, self._write_audio_metadata, durable)
 
     def add_audio(self, utterance_item):
-        self.audio_items.append(utterance_item)
-        self._save_audio_metadata()
+        with self.lock:
+            self._set_audio(utterance_item)
+            self.audio_items.append(utterance_item)
+            self._save_audio_metadata()
 
     def remove_audio(self, audio_id):
-        # The file is not deleted
-        self.audio_items = list(filter(lambda x: x.ID != audio_id, self.audio_items))
-        self._save_audio_metadata()
+        with self.lock:
+            if audio_id not in self.audio_ids:
+                return
+            self._remove_audio(audio_id)
+            self.audio_items = list(self.audio_ids.values())
+            self._save_audio_metadata()
+
+    # Error message of the first operation (see AudioShortcutOperation) that can't be applied after the ones before
+    # it, None if all of them can. Audio must be a file uploaded to the uploads folder.
+    # check_operations() and apply_operations() are called with self.lock held.
+    def check_operations(self, operations):
+        ids = set(self.audio_ids)
+        for number, operation in enumerate(operations):
+            if operation.Op in ['create', 'update'] and \
+                    (operation.Audio is None or not self.media_master.is_upload(operation.Audio.FilePath)):
+                return f"Audio shortcut operation {number}: an Audio with an uploaded FilePath is required!"
+            if operation.Op == 'update':
+                if operation.Audio.ID not in ids:
+                    return f"Audio shortcut operation {number}: shortcut {operation.Audio.ID} was not found!"
+            elif operation.Op == 'delete':
+                if operation.ID not in ids:
+                    return f"Audio shortcut operation {number}: shortcut {operation.ID} was not found!"
+                ids.discard(operation.ID)
+        return None
+
+    # Apply operations that passed check_operations(), the metadata is written once. Returns the IDs of the created
+    # shortcuts.
+    def apply_operations(self, operations):
+        created = []
+        for operation in operations:
+            if operation.Op == 'create':
+                operation.Audio.ID = uuid4()
+                self._set_audio(operation.Audio)
+                created.append(operation.Audio.ID)
+            elif operation.Op == 'update':
+                self._set_audio(operation.Audio)
+            else:
+                self._remove_audio(operation.ID)
+        if operations:
+            self.audio_items = list(self.audio_ids.values())
+            self._save_audio_metadata()
+        return created
+
+    # Add or replace the shortcut in self.audio_ids (not self.audio_items) and the indexes
+    def _set_audio(self, utterance_item):
+        self.audio_ids[utterance_item.ID] = utterance_item
+        self.actions_master.set_actions(utterance_item.ID, [utterance_item])
+        self._index_audio(utterance_item)
+        self.media_master.set_references(utterance_item.ID, [utterance_item.FilePath])
+        self.changes.changed('audio_shortcuts', utterance_item.ID)
+
+    def _remove_audio(self, audio_id):
+        # The file is left for the media garbage collection
+        del self.audio_ids[audio_id]
+        self.actions_master.release(audio_id)
+        self.search.release(audio_id)
+        self.media_master.release(audio_id)
+        self.changes.removed('audio_shortcuts', audio_id)
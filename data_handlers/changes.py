@@ -0,0 +1,46 @@
+from uuid import uuid4
+from threading import Lock
+
+
+# Version numbers of collections (sessions, shortcuts, motions) and of the items in them, for conditional requests
+# and syncing only what has changed. Every change increments a single counter, the version of an item is the counter
+# value of its last change, the version of a collection that of the last change in it.
+# Versions only live in memory, the epoch tells clients when they were reset (on restart).
+class ChangeTracker:
+    def __init__(self, collections):
+        self.epoch = uuid4().hex[:8]
+        self.version = 0
+        self.lock = Lock()
+        # Collection -> {item ID: (version, removed)}, ordered by version
+        self.changes = {collection: dict() for collection in collections}
+        self.collection_versions = {collection: 0 for collection in collections}
+
+    def changed(self, collection, item_id, removed=False):
+        with self.lock:
+            self.version += 1
+            self.changes[collection].pop(item_id, None)
+            self.changes[collection][item_id] = (self.version, removed)
+            self.collection_versions[collection] = self.version
+
+    def removed(self, collection, item_id):
+        self.changed(collection, item_id, removed=True)
+
+    # Items that haven't changed since startup are at version 0
+    def get_version(self, collection, item_id=None):
+        if item_id is None:
+            return self.collection_versions[collection]
+        return self.changes[collection].get(item_id, (0, False))[0]
+
+    def etag(self, collection, item_id=None):
+        return f'"{self.epoch}-{self.get_version(collection, item_id)}"'
+
+    # IDs of the items changed and removed after the given version, as ([changed], [removed])
+    def changes_since(self, collection, version):
+        changed = []
+        removed = []
+        with self.lock:
+            for item_id, (item_version, is_removed) in reversed(self.changes[collection].items()):
+                if item_version <= version:
+                    break
+                (removed if is_removed else changed).append(item_id)
+        return changed, removed
@@ -0,0 +1,88 @@
+import sys
+
+from uuid import UUID
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST
+
+# Fields whose strings repeat across sessions (motion names, groups, media file paths)
+INTERNED_FIELDS = {'Group', 'Name', 'FilePath', 'URL'}
+
+
+# Compact, read-only form of models held in memory in large numbers (the session library).
+# Each model class gets a record class with a slot per field instead of pydantic's per-instance dict and fields set,
+# lists of models become tuples of records and strings of the fields above are interned.
+# Records are turned back into models with expand() wherever models are needed (the API, storage, Pepper), a changed
+# model is compacted again: records are never modified.
+class Record:
+    __slots__ = ()
+    model = None
+
+
+_record_classes = {}
+
+# Field kinds
+MODEL, MODEL_LIST, ID, INTERNED, PLAIN = range(5)
+
+
+def record_class(model):
+    if model not in _record_classes:
+        plan = []
+        for name, field in model.__fields__.items():
+            kind = PLAIN
+            if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+                kind = MODEL_LIST if field.shape == SHAPE_LIST else MODEL
+            elif field.type_ is UUID:
+                kind = ID
+            elif field.type_ is str and name in INTERNED_FIELDS:
+                kind = INTERNED
+            plan.append((name, kind))
+        _record_classes[model] = type(f"{model.__name__}Record", (Record,),
+                                      {'__slots__': tuple(model.__fields__), 'model': model, 'plan': plan})
+    return _record_classes[model]
+
+
+# share_uuid(uuid) returns an equal UUID object to store instead, e.g. that of the motion a MotionItem links to
+def compact(model, share_uuid=None):
+    cls = _record_classes.get(type(model)) or record_class(type(model))
+    record = cls.__new__(cls)
+    values = model.__dict__
+    for name, kind in cls.plan:
+        value = values[name]
+        if value is not None and kind != PLAIN:
+            if kind == MODEL:
+                value = compact(value, share_uuid)
+            elif kind == MODEL_LIST:
+                value = tuple(compact(item, share_uuid) for item in value)
+            elif kind == ID:
+                if share_uuid is not None:
+                    value = share_uuid(value)
+            else:
+                value = sys.intern(value)
+        setattr(record, name, value)
+    return record
+
+
+# A new model with the values of the record, what BaseModel.construct() does (see construct_trusted in storage.py)
+def expand(record):
+    values = {}
+    for name, kind in record.plan:
+        value = getattr(record, name)
+        if value is not None:
+            if kind == MODEL:
+                value = expand(value)
+            elif kind == MODEL_LIST:
+                value = [expand(item) for item in value]
+        values[name] = value
+    instance = record.model.__new__(record.model)
+    object.__setattr__(instance, '__dict__', values)
+    object.__setattr__(instance, '__fields_set__', set(values))
+    return instance
+
+
+# A copy of the record with the given fields replaced (by records or plain values), the others shared
+def replace(record, **values):
+    copy = type(record).__new__(type(record))
+    for name in record.__slots__:
+        setattr(copy, name, values[name] if name in values else getattr(record, name))
+    return copy
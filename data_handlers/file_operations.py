@@ -1,72 +1,323 @@
 import os
 import json
 import shutil
-import zipfile
-import requests
+import tempfile
 
 from hashlib import sha256
 from datetime import datetime
+from threading import Event, Lock
+from concurrent.futures import ThreadPoolExecutor
 from aiofiles import open as async_open
 
 from fastapi import UploadFile
 from fastapi.encoders import jsonable_encoder
 
+from .variants import robot_audio, robot_audio_path
+from config import TTS_ENDPOINT, SYNTHESIS_WORKERS, SYNTHESIS_TIMEOUT
+
+# requests and zipfile are imported where they're used, they're only needed after startup
+
 
 def hash_phrase_to_filename(string):
     return sha256(string.encode()).hexdigest()
 
 
+# Uploads are read and written in chunks of this many bytes
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
 async def hash_file_to_filename(file):
-    file_content = b""
-    while content := await file.read(1024):
-        file_content += content
-    await file.seek(0)
-    return sha256(file_content).hexdigest()
+    file_hash = sha256()
+    while content := await file.read(UPLOAD_CHUNK_SIZE):
+        file_hash.update(content)
+    return file_hash.hexdigest()
 
 
-async def hash_and_save_file(file_content: UploadFile, file_type: str):
-    file_hash = await hash_file_to_filename(file_content)
-    save_path = os.path.join("data", "uploads", f"{file_hash}.{file_content.filename.rsplit('.', 1)[-1]}")
-    if not os.path.isfile(save_path):
-        async with async_open(save_path, "wb") as save_file:
-            while content := await file_content.read(1024):
+# Move a finished file to its final name, or discard it if that (content-addressed) name already exists
+def store_as(temp_path, save_path):
+    if os.path.isfile(save_path):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, save_path)
+    return save_path
+
+
+# Write an upload to data/uploads in a single pass, hashing it along the way.
+# The file is named after the sha256 hash of its content unless a name is given.
+async def save_upload(file, extension, name=None):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.join("data", "uploads"), suffix=".part")
+    os.close(fd)
+    try:
+        file_hash = sha256()
+        async with async_open(temp_path, "wb") as save_file:
+            while content := await file.read(UPLOAD_CHUNK_SIZE):
+                file_hash.update(content)
                 await save_file.write(content)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return store_as(temp_path, os.path.join("data", "uploads", f"{name or file_hash.hexdigest()}.{extension}"))
+
+
+async def hash_and_save_file(file_content: UploadFile, file_type: str):
+    save_path = await save_upload(file_content, file_content.filename.rsplit('.', 1)[-1])
     return {"filename": file_content.filename, "filepath": save_path, "message": f"{file_type} uploaded!"}
 
 
+# Speech files currently being synthesized, keyed by their target path.
+# Concurrent requests for the same phrase wait on the first request instead of calling Neurokõne again.
+_synthesis_lock = Lock()
+_synthesis_in_flight = {}
+
+
+def synthesis_filepath(phrase, speaker, speed=1.0):
+    return os.path.join('data', 'uploads', hash_phrase_to_filename(phrase + speaker + str(speed)) + ".wav")
+
+
+class SynthesisError(Exception):
+    pass
+
+
+# Keep-alive connections to Neurokõne, shared between synthesis threads (created on the first synthesis)
+_synthesis_session = None
+
+
+def _get_synthesis_session():
+    global _synthesis_session
+    import requests
+    with _synthesis_lock:
+        if _synthesis_session is None:
+            _synthesis_session = requests.Session()
+            for prefix in ['https://', 'http://']:
+                _synthesis_session.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=1,
+                                                                               pool_maxsize=SYNTHESIS_WORKERS))
+    return _synthesis_session
+
+
+def _request_synthesis(phrase, speaker, speed, filepath):
+    import requests
+    print("Synthesizing ", filepath)
+    # Write under a temporary name first, a half-written file must never pass as a cached result
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix=".part")
+    try:
+        with os.fdopen(fd, 'wb') as save_file, \
+                _get_synthesis_session().post(TTS_ENDPOINT,
+                                              json={'text': phrase,
+                                                    'speaker': speaker,
+                                                    'speed': speed},
+                                              timeout=SYNTHESIS_TIMEOUT,
+                                              stream=True) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                save_file.write(chunk)
+    except requests.RequestException as e:
+        os.remove(temp_path)
+        raise SynthesisError(str(e)) from e
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, filepath)
+    # The robot's copy of the previous audio must not outlive it
+    if os.path.isfile(robot_audio_path(filepath)):
+        os.remove(robot_audio_path(filepath))
+    robot_audio(filepath)
+
+
+# The hash-named file is the cache: existing files are reused unless force is set.
+# Raises SynthesisError if the synthesis request fails.
 def synthesize(phrase, speaker, speed=1.0, force=False):
-    print("Got phrase ", phrase)
-    filepath = os.path.join('data', 'uploads', hash_phrase_to_filename(phrase + speaker + str(speed)) + ".wav")
-    if force or not os.path.isfile(filepath):
-        print("Synthesizing ", filepath)
-        print(phrase, speaker, speed)
-        r = requests.post('https://api.tartunlp.ai/text-to-speech/v2', json={'text': phrase,
-                                                                             'speaker': speaker,
-                                                                             'speed': speed})
-        with open(filepath, 'wb') as save_file:
-            save_file.write(r.content)
-    else:
-        print("Skipping ", filepath, ", already exists")
+    filepath = synthesis_filepath(phrase, speaker, speed)
+    with _synthesis_lock:
+        if not force and os.path.isfile(filepath):
+            return filepath
+        in_flight = _synthesis_in_flight.get(filepath)
+        if in_flight is None:
+            in_flight = _synthesis_in_flight[filepath] = Event()
+            owner = True
+        else:
+            owner = False
+
+    # Another request is already synthesizing this phrase, share its result
+    if not owner:
+        in_flight.wait()
+        if not os.path.isfile(filepath):
+            raise SynthesisError(f"Synthesis of {filepath} failed")
+        return filepath
 
+    try:
+        _request_synthesis(phrase, speaker, speed, filepath)
+    finally:
+        with _synthesis_lock:
+            _synthesis_in_flight.pop(filepath, None)
+        in_flight.set()
     return filepath
 
 
+# Synthesize a collection of (phrase, speaker, speed) triples concurrently, each distinct triple once.
+# Returns a dict mapping each triple to its file path, or to the exception raised while synthesizing it.
+# on_result(triple, result) is called as each triple finishes.
+def synthesize_batch(triples, force=False, on_result=None):
+    results = {}
+    unique_triples = list(dict.fromkeys(triples))
+    if not unique_triples:
+        return results
+
+    def worker(triple):
+        try:
+            result = synthesize(*triple, force=force)
+        except SynthesisError as e:
+            result = e
+        results[triple] = result
+        if on_result is not None:
+            on_result(triple, result)
+
+    with ThreadPoolExecutor(max_workers=min(SYNTHESIS_WORKERS, len(unique_triples))) as executor:
+        for future in [executor.submit(worker, triple) for triple in unique_triples]:
+            future.result()
+    return results
+
+
+# Open an exported archive, returning the archive and the contents of its JSON document (None if it is missing)
+def read_archive(archive, document):
+    import zipfile
+    archive_zip = zipfile.ZipFile(archive)
+    if document not in archive_zip.namelist():
+        return archive_zip, None
+    with archive_zip.open(document) as document_file:
+        return archive_zip, json.load(document_file)
+
+
+# Stream the media files of an archive to data/uploads one by one.
+# Media is named by content hash, so files already present under the same name are skipped.
+def extract_archive_media(archive_zip):
+    extracted = []
+    for member in archive_zip.infolist():
+        if not member.filename.startswith('uploads/') or member.is_dir():
+            continue
+        # Extract the file manually to avoid wonky directory creation via ZipFile.extract()
+        save_path = os.path.join('data', 'uploads', os.path.basename(member.filename))
+        if os.path.isfile(save_path):
+            continue
+        fd, temp_path = tempfile.mkstemp(dir=os.path.join('data', 'uploads'), suffix='.part')
+        with os.fdopen(fd, 'wb') as save_file, archive_zip.open(member) as archived_file:
+            shutil.copyfileobj(archived_file, save_file, UPLOAD_CHUNK_SIZE)
+        extracted.append(store_as(temp_path, save_path))
+    return extracted
+
+
+# Write-only file object collecting the output of a ZipFile, so the archive can be sent as it is built
+class _ArchiveStream:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def session_archive_path(session):
+    return os.path.join("data", "compressed_sessions", session.Name + ".zip")
+
+
+# The serialized session, its media files as (path, archive name) pairs and a hash identifying the archive content
+def _session_archive_contents(session):
+    session_json = json.dumps(jsonable_encoder(session))
+    media = {}
+    for item in session.Items:
+        for action in item.Actions:
+            for child in [action.UtteranceItem, action.ImageItem]:
+                if child and child.FilePath and os.path.isfile(child.FilePath):
+                    media[child.FilePath] = os.path.join("uploads", os.path.basename(child.FilePath))
+    content_hash = sha256(session_json.encode())
+    for path in sorted(media):
+        stat = os.stat(path)
+        content_hash.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return session_json, list(media.items()), content_hash.hexdigest()
+
+
+# The stored archive of the session, if it is up-to-date (the content hash is kept in the archive comment)
+def cached_session_archive(session, content_hash=None):
+    import zipfile
+    if content_hash is None:
+        content_hash = _session_archive_contents(session)[2]
+    file_path = session_archive_path(session)
+    try:
+        with zipfile.ZipFile(file_path) as zip_file:
+            if zip_file.comment.decode() == content_hash:
+                return file_path
+    except (FileNotFoundError, zipfile.BadZipFile):
+        pass
+    return None
+
+
+# Generate a zip archive chunk by chunk. documents are (archive name, text) pairs and get deflated,
+# media files are (path, archive name) pairs stored as is (they barely compress).
+# If cache_path is given, a copy of the archive is stored there once complete.
+def stream_archive(documents, media, comment="", cache_path=None):
+    import zipfile
+    stream = _ArchiveStream()
+    cache_file = None
+    if cache_path is not None:
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".part")
+        cache_file = os.fdopen(fd, "wb")
+
+    def take():
+        data = stream.pop()
+        if cache_file is not None:
+            cache_file.write(data)
+        return data
+
+    try:
+        with zipfile.ZipFile(stream, "w") as zip_file:
+            zip_file.comment = comment.encode()
+            for arcname, text in documents:
+                zip_file.writestr(arcname, text, compress_type=zipfile.ZIP_DEFLATED)
+            yield take()
+            for file_path, arcname in media:
+                zip_info = zipfile.ZipInfo.from_file(file_path, arcname)
+                zip_info.compress_type = zipfile.ZIP_STORED
+                with open(file_path, "rb") as media_file, zip_file.open(zip_info, "w") as archived_file:
+                    while content := media_file.read(UPLOAD_CHUNK_SIZE):
+                        archived_file.write(content)
+                        yield take()
+        yield take()
+        if cache_file is not None:
+            cache_file.close()
+            os.replace(temp_path, cache_path)
+    finally:
+        if cache_file is not None:
+            if not cache_file.closed:
+                cache_file.close()
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+
+# Generate the session archive chunk by chunk, storing a copy in data/compressed_sessions once complete
+def stream_session_archive(session):
+    session_json, media, content_hash = _session_archive_contents(session)
+    return stream_archive([("session.json", session_json)], media, comment=content_hash,
+                          cache_path=session_archive_path(session))
+
+
 def compress_session(session):
-    file_path = os.path.join("data", "compressed_sessions", session.Name + ".zip")
-    with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        zip_file.writestr("session.json", json.dumps(jsonable_encoder(session)))
-        for item in session.Items:
-            for action in item.Actions:
-                if action.UtteranceItem and action.UtteranceItem.FilePath:
-                    zip_file.write(action.UtteranceItem.FilePath,
-                                   arcname=os.path.join("uploads", os.path.basename(action.UtteranceItem.FilePath)))
-                if action.ImageItem and action.ImageItem.FilePath:
-                    zip_file.write(action.ImageItem.FilePath,
-                                   arcname=os.path.join("uploads", os.path.basename(action.ImageItem.FilePath)))
+    file_path = cached_session_archive(session)
+    if file_path is None:
+        for _ in stream_session_archive(session):
+            pass
+        file_path = session_archive_path(session)
     return {"relative_path": file_path, "message": "Session exported, check your browser downloads!"}
 
 
 def compress_recordings():
+    import zipfile
     file_path = os.path.join("data", "recordings",
                              str(datetime.now()).split(".")[0].replace(" ", "-").replace(":", "-") + ".zip")
     for subdir in ['audio', 'sessions']:
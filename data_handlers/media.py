@@ -0,0 +1,118 @@
+import os
+import time
+
+from threading import Lock
+
+# Suffixes of files derived from an upload, e.g. <hash>_robot.wav (see variants.py)
+VARIANT_SUFFIXES = ['robot', 'tablet', 'thumb']
+
+AUDIO_EXTENSIONS = ['wav', 'mp3', 'ogg']
+IMAGE_EXTENSIONS = ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp']
+
+
+# The hash (or other base name) of an uploaded file, shared by the file and its variants
+def media_hash(filename):
+    stem = os.path.basename(filename).split('.', 1)[0]
+    if '_' in stem and stem.rsplit('_', 1)[1] in VARIANT_SUFFIXES:
+        stem = stem.rsplit('_', 1)[0]
+    return stem
+
+
+def media_type(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension in AUDIO_EXTENSIONS:
+        return "audio"
+    if extension in IMAGE_EXTENSIONS:
+        return "image"
+    return "other"
+
+
+# Index of the files in the uploads folder and of the sessions/shortcuts ("owners") referencing them.
+# Owners report their complete set of file paths on every change, which keeps the reference counts idempotent.
+class MediaHandler:
+    def __init__(self, uploads_folder, trash_folder):
+        self.uploads_folder = uploads_folder
+        self.trash_folder = trash_folder
+        self.lock = Lock()
+        # Owner ID -> set of referenced file hashes
+        self.owners = dict()
+        # File hash -> set of owner IDs
+        self.references = dict()
+
+    def _hashes(self, paths):
+        uploads = os.path.normpath(self.uploads_folder)
+        return {media_hash(path) for path in paths
+                if path and os.path.dirname(os.path.normpath(path)) == uploads}
+
+    # Whether the path is a file in the uploads folder
+    def is_upload(self, path):
+        return bool(path) and os.path.dirname(os.path.normpath(path)) == os.path.normpath(self.uploads_folder) and \
+            os.path.isfile(path)
+
+    def set_references(self, owner_id, paths):
+        hashes = self._hashes(paths)
+        with self.lock:
+            for file_hash in self.owners.get(owner_id, set()) - hashes:
+                self._unreference(owner_id, file_hash)
+            for file_hash in hashes:
+                self.references.setdefault(file_hash, set()).add(owner_id)
+            if hashes:
+                self.owners[owner_id] = hashes
+            else:
+                self.owners.pop(owner_id, None)
+
+    def release(self, owner_id):
+        with self.lock:
+            for file_hash in self.owners.pop(owner_id, set()):
+                self._unreference(owner_id, file_hash)
+
+    def _unreference(self, owner_id, file_hash):
+        owners = self.references.get(file_hash, set())
+        owners.discard(owner_id)
+        if not owners:
+            self.references.pop(file_hash, None)
+
+    def get_reference_count(self, filename):
+        return len(self.references.get(media_hash(filename), ()))
+
+    def get_media(self):
+        media = []
+        with self.lock:
+            for entry in os.scandir(self.uploads_folder):
+                if entry.is_file() and not entry.name.endswith('.part'):
+                    media.append({"File": entry.name,
+                                  "Hash": media_hash(entry.name),
+                                  "Size": entry.stat().st_size,
+                                  "Type": media_type(entry.name),
+                                  "References": len(self.references.get(media_hash(entry.name), ()))})
+        return {"media": media, "total_size": sum(x['Size'] for x in media)}
+
+    # Move unreferenced files to the trash folder, delete files that have been in the trash longer than retention.
+    # Files modified less than grace_period seconds ago are kept, as they may not have been saved to a session yet
+    # (fresh uploads, synthesis results, unfinished temporary files).
+    def collect_garbage(self, grace_period, retention):
+        now = time.time()
+        trashed = []
+        deleted = []
+        with self.lock:
+            for entry in os.scandir(self.uploads_folder):
+                if not entry.is_file() or media_hash(entry.name) in self.references:
+                    continue
+                if now - entry.stat().st_mtime < grace_period:
+                    continue
+                trash_path = os.path.join(self.trash_folder, entry.name)
+                os.replace(entry.path, trash_path)
+                # The modification time marks the moment of trashing
+                os.utime(trash_path)
+                trashed.append(entry.name)
+
+        freed = 0
+        for entry in os.scandir(self.trash_folder):
+            if entry.is_file() and now - entry.stat().st_mtime > retention:
+                freed += entry.stat().st_size
+                os.remove(entry.path)
+                deleted.append(entry.name)
+        return {"message": f"Moved {len(trashed)} unused files to the trash, deleted {len(deleted)} files.",
+                "trashed": trashed,
+                "deleted": deleted,
+                "freed_bytes": freed}
@@ -0,0 +1,116 @@
+import os
+import mimetypes
+
+from email.utils import formatdate
+from aiofiles import open as async_open
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+from config import MEDIA_CACHE_MAX_AGE
+from data_handlers.media import media_type
+
+
+# Single byte range "bytes=start-end" as (start, end) with end exclusive.
+# None for a missing, malformed or multi-part range (served in full), (size, size) if unsatisfiable.
+def parse_range(range_header, size):
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start, _, end = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start:
+            start = int(start)
+            end = min(int(end) + 1, size) if end else size
+        elif end:
+            # Suffix range, the last <end> bytes
+            start, end = max(size - int(end), 0), size
+        else:
+            return None
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        return size, size
+    return start, end
+
+
+# A file in the uploads folder, its ETag being its hash name plus the modification time.
+# Images (and their variants) are named after their content, so they're cached as immutable. Audio may be named after
+# its phrase instead (synthesized speech, audio shortcuts) and replaced in place by a forced synthesis, clients
+# revalidate it (a 304 while it's unchanged).
+class MediaFileResponse(Response):
+    chunk_size = 64 * 1024
+
+    def __init__(self, path, stat_result, method, range_header=None, if_range=None):
+        self.path = path
+        self.send_body = method != "HEAD"
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.etag = f'"{os.path.basename(path).rsplit(".", 1)[0]}-{stat_result.st_mtime_ns:x}"'
+
+        size = stat_result.st_size
+        self.start, self.end = 0, size
+        self.status_code = 200
+        headers = {"etag": self.etag,
+                   "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+                   "cache-control": f"public, max-age={MEDIA_CACHE_MAX_AGE}, immutable"
+                   if media_type(path) == "image" else "public, no-cache",
+                   "accept-ranges": "bytes"}
+
+        # If-Range: only serve the requested part if the client's copy is still current
+        byte_range = parse_range(range_header, size) if if_range in [None, self.etag] else None
+        if byte_range == (size, size):
+            self.status_code = 416
+            self.start = self.end = 0
+            headers["content-range"] = f"bytes */{size}"
+        elif byte_range is not None:
+            self.status_code = 206
+            self.start, self.end = byte_range
+            headers["content-range"] = f"bytes {self.start}-{self.end - 1}/{size}"
+        headers["content-length"] = str(self.end - self.start)
+        self.init_headers(headers)
+        self.background = None
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers})
+        if not self.send_body or self.end == self.start:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        # Let the server send the file with sendfile() if it supports the ASGI zero-copy extension
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend",
+                            "file": file,
+                            "offset": self.start,
+                            "count": self.end - self.start,
+                            "more_body": False})
+            return
+
+        async with async_open(self.path, "rb") as file:
+            await file.seek(self.start)
+            remaining = self.end - self.start
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # The file was truncated while sending, end the response
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+# StaticFiles for the uploads folder with long-lived caching, ETags, conditional and range requests
+class MediaFiles(StaticFiles):
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        response = MediaFileResponse(full_path, stat_result, scope["method"],
+                                     range_header=request_headers.get("range"),
+                                     if_range=request_headers.get("if-range"))
+        if_none_match = [tag.strip() for tag in request_headers.get("if-none-match", "").split(",")]
+        # Weak comparison, as required for If-None-Match
+        if "*" in if_none_match or response.etag in [tag[2:] if tag.startswith("W/") else tag for tag in if_none_match]:
+            return NotModifiedResponse(response.headers)
+        return response
@@ -1,23 +1,24 @@
 import os
 import json
 from uuid import uuid4
-from fastapi.encoders import jsonable_encoder
 from data_handlers.action import MotionItem
+from data_handlers.storage import load_model
 
 
 # Handler for the list of motions available to Pepper
 # Handlers for sessions and actions may store motions unknown to this, therefore unknown to Pepper
 class MotionsHandler:
-    def __init__(self, motions_file, additional_motions_folder, actions_handler):
+    def __init__(self, motions_store, additional_motions_folder, actions_handler, persistence_manager, change_tracker):
         self.motions = dict()
-        self.save_file = motions_file
+        self.store = motions_store
         self.actions_master = actions_handler
+        self.persistence = persistence_manager
+        self.changes = change_tracker
 
         # Load previously saved motions
-        with open(motions_file) as f:
-            motions_list = json.load(f)['motions']
+        motions_list = self.store.load()
         for motion in motions_list:
-            self.motions[motion['Name']] = MotionItem.parse_obj(motion)
+            self.motions[motion['Name']] = load_model(MotionItem, motion)
 
         # Load external motions
         for folder in os.listdir(additional_motions_folder):
@@ -31,7 +32,9 @@ class MotionsHandler:
                                                                          'Name': motion['Name'],
                                                                          'FilePath': motion['FilePath']})
 
-        self.actions_master.add_actions(self.motions.values())
+        # Motion ID -> motion
+        self.motion_ids = {motion.ID: motion for motion in self.motions.values()}
+        self.actions_master.set_actions('motions', self.motions.values())
 
     def add_motion(self, name, group="Remote", path=""):
         if name not in self.motions.keys():
@@ -41,22 +44,31 @@ class MotionsHandler:
                                             "Name": name,
                                             "FilePath": path}))
             self.motions[name] = motion
-            self.actions_master.add_action(motion)
+            self.motion_ids[motion.ID] = motion
+            self.actions_master.add_actions('motions', [motion])
+            self.changes.changed('motions', motion.ID)
 
     def add_motions(self, movements):
         for motion_name in movements['moves']:
             self.add_motion(motion_name)
         self.save_motions()
 
-    def save_motions(self):
-        with open(self.save_file, "w") as f:
-            f.write(json.dumps(jsonable_encoder(self.get_motions())))
+    def _write_motions(self):
+        self.store.save(list(self.motions.values()))
+
+    def save_motions(self, durable=False):
+        self.persistence.mark_dirty(self.store, self._write_motions, durable)
 
     def get_motions(self):
         return {"motions": list(self.motions.values())}
 
     def get_motion_by_id(self, motion_id):
-        return next((x for x in self.motions.values() if x.ID == motion_id), None)
+        return self.motion_ids.get(motion_id)
 
     def get_motion_by_name(self, motion_name):
         return self.motions.get(motion_name)
+
+    def check_indexes(self):
+        if self.motion_ids != {motion.ID: motion for motion in self.motions.values()}:
+            return ["The motion ID index doesn't match the motions"]
+        return []
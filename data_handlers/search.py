@@ -0,0 +1,125 @@
+import re
+import unicodedata
+
+from bisect import bisect_left, insort
+from threading import Lock
+
+# Estonian letters are also written without their diacritics (õ, ä, ö, ü) or as sh and zh (š, ž)
+FOLDED_LETTERS = str.maketrans({'õ': 'o', 'ä': 'a', 'ö': 'o', 'ü': 'u', 'š': 'sh', 'ž': 'zh'})
+
+
+# Lower case words of the text. NFC normalisation makes letters with diacritics single characters, so they're
+# part of words (and "jäätis" typed with a combining diaeresis is the same word).
+def tokenize(text):
+    if not text:
+        return []
+    return re.findall(r"\w+", unicodedata.normalize("NFC", text).lower())
+
+
+def fold(term):
+    return term.translate(FOLDED_LETTERS)
+
+
+# In-memory inverted index of sessions, questions and actions (see session_documents in session.py and
+# action_texts in action.py), updated by the handlers as they change.
+# Like MediaHandler references, documents belong to owners (a session, a shortcut) that set all of them on every change
+# (or change some of them, see SessionsHandler.patch_session).
+class SearchIndex:
+    def __init__(self):
+        self.lock = Lock()
+        # (owner ID, group, ID) -> (hit, terms)
+        self.documents = dict()
+        # Owner ID -> keys of its documents
+        self.owned = dict()
+        # Term -> keys of the documents with it
+        self.postings = dict()
+        # Every term, and (folded term, term) for those with letters to fold, sorted for prefix matching
+        self.terms = []
+        self.folded_terms = []
+
+    # documents: [(group, hit, [texts])], hit being what search() returns for the document (with an "ID")
+    # in the group ("sessions", "items" or "actions")
+    def set_documents(self, owner_id, documents):
+        with self.lock:
+            for key in self.owned.pop(owner_id, ()):
+                self._remove_document(key)
+            for document in documents:
+                self._add_document(owner_id, *document)
+
+    # Replace or add some of the documents of the owner, removing its documents with the IDs in removed
+    def change_documents(self, owner_id, documents, removed=()):
+        removed = set(removed) | {hit['ID'] for _, hit, _ in documents}
+        with self.lock:
+            for key in [key for key in self.owned.get(owner_id, ()) if key[2] in removed]:
+                self.owned[owner_id].discard(key)
+                self._remove_document(key)
+            for document in documents:
+                self._add_document(owner_id, *document)
+
+    def release(self, owner_id):
+        with self.lock:
+            for key in self.owned.pop(owner_id, ()):
+                self._remove_document(key)
+
+    def _add_document(self, owner_id, group, hit, texts):
+        key = (owner_id, group, hit['ID'])
+        terms = tuple({term for text in texts for term in tokenize(text)})
+        self.documents[key] = (hit, terms)
+        self.owned.setdefault(owner_id, set()).add(key)
+        for term in terms:
+            if term not in self.postings:
+                self.postings[term] = set()
+                insort(self.terms, term)
+                if fold(term) != term:
+                    insort(self.folded_terms, (fold(term), term))
+            self.postings[term].add(key)
+
+    def _remove_document(self, key):
+        _, terms = self.documents.pop(key)
+        for term in terms:
+            self.postings[term].discard(key)
+            if not self.postings[term]:
+                del self.postings[term]
+                self.terms.pop(bisect_left(self.terms, term))
+                if fold(term) != term:
+                    self.folded_terms.pop(bisect_left(self.folded_terms, (fold(term), term)))
+
+    # Terms starting with the token. A token without Estonian letters also matches terms with them (e.g. "oun"
+    # matches "õun"). Returns {term: whether it's the whole token}.
+    def _matching_terms(self, token):
+        # The first string after every one starting with token
+        end = token[:-1] + chr(ord(token[-1]) + 1)
+        matches = {term: term == token
+                   for term in self.terms[bisect_left(self.terms, token):bisect_left(self.terms, end)]}
+        if fold(token) == token:
+            for folded, term in self.folded_terms[bisect_left(self.folded_terms, (token,)):
+                                                  bisect_left(self.folded_terms, (end,))]:
+                matches[term] = folded == token
+        return matches
+
+    # Documents with a word starting with each word of the query, by group, at most limit per group.
+    # Documents where more of the query words are whole words come first, ties by ID (and owner) so the order is stable.
+    def search(self, query, limit):
+        hits = {"sessions": [], "items": [], "actions": []}
+        tokens = tokenize(query)
+        if not tokens:
+            return hits
+        with self.lock:
+            scores = None
+            for token in tokens:
+                found = {}
+                for term, whole in self._matching_terms(token).items():
+                    for key in self.postings[term]:
+                        found[key] = found.get(key, False) or whole
+                if scores is None:
+                    scores = {key: int(whole) for key, whole in found.items()}
+                else:
+                    scores = {key: scores[key] + found[key] for key in scores.keys() & found.keys()}
+            for key in sorted(scores, key=lambda key: (-scores[key], str(key[2]), str(key[0]))):
+                group = hits.setdefault(key[1], [])
+                if len(group) < limit:
+                    group.append(self.documents[key][0])
+        return hits
+
+    def get_statistics(self):
+        return {'documents': len(self.documents), 'terms': len(self.terms)}
@@ -1,10 +1,18 @@
+import os
 import json
+import time
+from threading import Lock, RLock, Thread
+from bisect import bisect_left, bisect_right, insort
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime, timezone
 from uuid import UUID, uuid4
-from pydantic import BaseModel
+from typing import Literal
+from pydantic import BaseModel, Field
 from pydantic.schema import List, Optional
-from fastapi.encoders import jsonable_encoder
 
-from data_handlers.action import MultiAction, initialise_child_ids, rename_files
+from data_handlers.action import MultiAction, initialise_child_ids, rename_files, action_texts, action_phrase
+from data_handlers.storage import load_model
+from data_handlers.compact import Record, compact, expand, replace
 
 
 # TODO: Are all these IDs, names, groups etc. really necessary?
@@ -23,40 +31,431 @@ class Session(BaseModel):
     Items: List[SessionItem]
 
 
+# A change to one question or action of a session (see SessionsHandler.patch_session):
+# add: Item at Position (the end by default), or Action at Position in the question ItemID
+# replace: the question or action ID with Item or Action (which takes its ID)
+# move: the question ID to Position, or the action ID to Position in the question ItemID (its own by default)
+# delete: the question or action ID
+class SessionOperation(BaseModel):
+    Op: Literal['add', 'replace', 'move', 'delete']
+    ID: UUID = None
+    ItemID: UUID = None
+    Position: Optional[int] = Field(None, ge=0)
+    Item: Optional[SessionItem]
+    Action: Optional[MultiAction]
+
+    # The actions this operation adds to the session
+    def get_actions(self):
+        if self.Item is not None:
+            return self.Item.Actions
+        return [self.Action] if self.Action is not None else []
+
+
+class SessionPatch(BaseModel):
+    Operations: List[SessionOperation]
+
+
 # Set missing IDs, remove redundant UtteranceItem pronunciation attributes
 def session_cleanup(session):
     zero = UUID('00000000-0000-0000-0000-000000000000')
     if session.ID is None or session.ID == zero:
         session.ID = uuid4()
     for session_item in session.Items:
-        if session_item.ID is None or session_item.ID == zero:
-            session_item.ID = uuid4()
-        for action in session_item.Actions:
-            if action.ID is None or action.ID == zero:
-                action.ID = uuid4()
-            initialise_child_ids(action)
-            action.UtteranceItem.pronunciation_cleanup()
+        item_cleanup(session_item)
+
+
+def item_cleanup(session_item):
+    zero = UUID('00000000-0000-0000-0000-000000000000')
+    if session_item.ID is None or session_item.ID == zero:
+        session_item.ID = uuid4()
+    for action in session_item.Actions:
+        action_cleanup(action)
+
+
+def action_cleanup(action):
+    zero = UUID('00000000-0000-0000-0000-000000000000')
+    if action.ID is None or action.ID == zero:
+        action.ID = uuid4()
+    initialise_child_ids(action)
+    action.UtteranceItem.pronunciation_cleanup()
+
+
+# Every action of the session and their children, for sessions and their records alike
+def session_actions(session):
+    return [action for session_item in session.Items for action in item_actions(session_item)]
+
+
+def item_actions(session_item):
+    actions = []
+    for action in session_item.Actions:
+        actions.append(action)
+        actions.extend(child for child in [action.UtteranceItem, action.ImageItem, action.MotionItem, action.URLItem]
+                       if child is not None and child.ID is not None)
+    return actions
+
+
+# Search index documents (see search.py) of a session or its record: the session, its questions and their actions.
+# A question has the texts of all of its actions.
+def session_documents(session):
+    documents = [("sessions", {"ID": session.ID, "Name": session.Name}, [session.Name, session.Description])]
+    for session_item in session.Items:
+        documents += item_documents(session, session_item)
+    return documents
+
+
+def item_documents(session, session_item):
+    documents = []
+    item_texts = []
+    for action in session_item.Actions:
+        texts = action_texts(action)
+        item_texts += texts
+        documents.append(("actions", {"ID": action.ID, "Collection": "sessions", "SessionID": session.ID,
+                                      "ItemID": session_item.ID, "Phrase": action_phrase(action)}, texts))
+    documents.append(("items", {"ID": session_item.ID, "SessionID": session.ID, "SessionName": session.Name},
+                      item_texts))
+    return documents
+
+
+# For sessions and their records alike
+def session_media_paths(session):
+    return [child.FilePath for session_item in session.Items for action in session_item.Actions
+            for child in [action.UtteranceItem, action.ImageItem] if child and child.FilePath]
+
+
+# UtteranceItems of the MultiActions with a phrase but no audio file on disk
+def utterances_missing_audio(actions):
+    missing = []
+    for action in actions:
+        utterance = action.UtteranceItem
+        if utterance and utterance.Phrase and utterance.ID is not None:
+            if not utterance.FilePath or not os.path.isfile(utterance.FilePath):
+                missing.append(utterance)
+    return missing
+
+
+# Position of the question in items (records or models), None if it isn't there
+def _item_position(items, item_id):
+    return next((position for position, session_item in enumerate(items) if session_item.ID == item_id), None)
+
+
+# (question position, action position) of the action in items, None if it isn't there
+def _action_position(items, action_id):
+    for item_position, session_item in enumerate(items):
+        for position, action in enumerate(session_item.Actions):
+            if action.ID == action_id:
+                return item_position, position
+    return None
+
+
+# Error message if the actions repeat an action ID, among themselves or of the questions in items (except the question
+# at the replaced position), None if their IDs are new
+def _duplicate_action_error(items, actions, replaced=None):
+    ids = set()
+    for action in actions:
+        if action.ID in ids:
+            return f"Action {action.ID} is given more than once!"
+        ids.add(action.ID)
+    for position, session_item in enumerate(items):
+        if position != replaced:
+            for action in session_item.Actions:
+                if action.ID in ids:
+                    return f"Action {action.ID} already exists!"
+    return None
+
+
+# Error message if position is given and isn't in 0..last, None otherwise
+def _position_error(position, last):
+    if position is not None and not 0 <= position <= last:
+        return f"Position {position} is out of range (0-{last})!"
+    return None
+
+
+# The first action of a question is its primary action
+def _set_primary_actions(session_item):
+    for position, action in enumerate(session_item.Actions):
+        action.PrimaryAction = position == 0
+
+
+# The question at position as a model that can be changed, expanding its record
+def _changeable_item(items, position):
+    if isinstance(items[position], Record):
+        items[position] = expand(items[position])
+    return items[position]
 
 
 class SessionsHandler:
-    def __init__(self, sessions_file, actions_handler, motions_handler):
+    def __init__(self, session_store, actions_handler, motions_handler, media_handler, persistence_manager,
+                 change_tracker, search_index, working_set_size=0):
         self.actions_master = actions_handler
         self.motions_master = motions_handler
-        self.save_file = sessions_file
-
-        # Load data from a JSON savefile
-        with open(sessions_file) as f:
-            sessions_list = json.load(f)['sessions']
+        self.media_master = media_handler
+        self.persistence = persistence_manager
+        self.changes = change_tracker
+        self.search = search_index
+        self.store = session_store
+        # Held while sessions change or are read into the working set, requests and synthesis jobs change them from
+        # different threads
+        self.lock = RLock()
+        # Sessions kept in memory (see SESSION_WORKING_SET in config.py), 0 for all of them
+        self.working_set_size = working_set_size
+
+        # Session ID -> session record (see compact.py): every session in the order of addition or, with a working
+        # set, the sessions in it, least recently used first. Only sessions in here have their actions registered.
+        # Sessions are only models at the API boundary: get_session() and the like expand records into models,
+        # changed sessions are compacted again by _set_session().
+        self.sessions = dict()
+        # Session ID -> {"Name": ..., "Description": ..., "ItemCount": ..., "Modified": UNIX time of the last change,
+        # "Items": item IDs, "Actions": MultiAction IDs} of every session, in the order of addition
+        self.summaries = dict()
+        # SessionItem ID and MultiAction ID -> session ID of every session (from the summaries), for finding sessions
+        # outside the working set
+        self.locations = dict()
+        # Name -> IDs of the sessions with that name
+        self.names = dict()
+        # (Name, str(ID)) of every session, kept sorted
+        self.sorted_keys = []
+        # SessionItem ID -> (session ID, item record) and MultiAction ID -> (session ID, item record) of the sessions
+        # in self.sessions
+        self.items = dict()
+        self.actions = dict()
+        # IDs of the sessions not in the search index, it's built on the first search (see index_sessions)
+        self.unindexed = set()
+        # Session ID -> record of the sessions whose last change isn't written to storage yet, read from here rather
+        # than from storage when they aren't in memory. The persistence thread changes it too, hence its own lock.
+        self.unsaved = dict()
+        self.unsaved_lock = Lock()
+
+        # Load data from storage
+        summaries = self.store.summaries()
+        if not self.working_set_size:
+            for session in self.store.load_all():
+                session = load_model(Session, session)
+                self._set_session(session, summaries[str(session.ID)]['Modified'], index=False)
+        else:
+            for session_id, summary in summaries.items():
+                session_id = UUID(session_id)
+                self._index_summary(session_id, {**self._summary_fields(summary),
+                                                 "Modified": summary['Modified'],
+                                                 "Items": tuple(map(UUID, summary['Items'])),
+                                                 "Actions": tuple(map(UUID, summary['Actions']))})
+                self.media_master.set_references(session_id, summary['Media'])
+                self.unindexed.add(session_id)
+
+        if self.working_set_size:
+            self.actions_master.set_loader(self.load_action)
+
+    # Linked motions share the ID object of the motion
+    def _share_uuid(self, value):
+        motion = self.motions_master.get_motion_by_id(value)
+        return motion.ID if motion is not None else value
+
+    # Summary of a session or its record
+    @staticmethod
+    def _summarise(session, modified):
+        return {"Name": session.Name,
+                "Description": session.Description,
+                "ItemCount": len(session.Items),
+                "Modified": modified,
+                "Items": tuple(session_item.ID for session_item in session.Items),
+                "Actions": tuple(action.ID for session_item in session.Items for action in session_item.Actions)}
+
+    @staticmethod
+    def _summary_fields(summary):
+        return {key: summary[key] for key in ["Name", "Description", "ItemCount"]}
+
+    # Compact the session in place of any session with the same ID, indexing it and registering its actions and media.
+    # index: add it to the search index (right away rather than on the first search). Returns the record.
+    def _set_session(self, session, modified=None, index=True):
+        for session_item in session.Items:
+            _set_primary_actions(session_item)
+        record = compact(session, self._share_uuid)
+        if (replaced := self.sessions.get(session.ID)) is not None:
+            self._unindex_session(replaced)
+        if session.ID in self.summaries:
+            self._unindex_summary(session.ID)
+        self._index_summary(session.ID, self._summarise(record, modified or time.time()))
+        self._index_session(record)
+        self.media_master.set_references(session.ID, session_media_paths(session))
+        if index:
+            self.search.set_documents(session.ID, session_documents(record))
+            self.unindexed.discard(session.ID)
+        else:
+            self.unindexed.add(session.ID)
+        return record
+
+    def _index_summary(self, session_id, summary):
+        self.summaries[session_id] = summary
+        self._locate(session_id, summary)
+        self.names.setdefault(summary['Name'], []).append(session_id)
+        insort(self.sorted_keys, (summary['Name'], str(session_id)))
+
+    def _unindex_summary(self, session_id):
+        summary = self.summaries.pop(session_id)
+        self._unlocate(session_id, summary)
+        name = summary['Name']
+        self.names[name].remove(session_id)
+        if not self.names[name]:
+            del self.names[name]
+        self.sorted_keys.pop(bisect_left(self.sorted_keys, (name, str(session_id))))
+
+    def _locate(self, session_id, summary):
+        for key in summary['Items'] + summary['Actions']:
+            self.locations[key] = session_id
+
+    def _unlocate(self, session_id, summary):
+        for key in summary['Items'] + summary['Actions']:
+            if self.locations.get(key) == session_id:
+                del self.locations[key]
+
+    # Put the record in self.sessions, the least recently used session leaving the working set if it's full
+    def _index_session(self, session):
+        self.sessions[session.ID] = session
+        for session_item in session.Items:
+            self._index_item(session.ID, session_item)
+        self.actions_master.set_actions(session.ID, session_actions(session))
+        if self.working_set_size:
+            while len(self.sessions) > self.working_set_size:
+                self._unindex_session(next(iter(self.sessions.values())))
+
+    def _unindex_session(self, session):
+        self.sessions.pop(session.ID, None)
+        for session_item in session.Items:
+            self._unindex_item(session_item)
+        self.actions_master.release(session.ID)
 
-        # Replacing dictionaries with objects where viable, bottom-up
-        self.sessions = []
-        for session in sessions_list:
-            self.sessions.append(Session.parse_obj(session))
-            self.add_session_actions_to_action_master(self.sessions[-1])
+    def _index_item(self, session_id, session_item):
+        self.items[session_item.ID] = (session_id, session_item)
+        for action in session_item.Actions:
+            self.actions[action.ID] = (session_id, session_item)
 
-    def save_sessions(self):
-        with open(self.save_file, "w") as f:
-            f.write(json.dumps(jsonable_encoder(self.get_sessions())))
+    def _unindex_item(self, session_item):
+        self.items.pop(session_item.ID, None)
+        for action in session_item.Actions:
+            self.actions.pop(action.ID, None)
+
+    # The record of the session, read from storage if it isn't in memory.
+    # keep: put it in the working set as the most recently used session, otherwise a session read from storage is
+    # only returned (for going through many sessions without replacing the working set)
+    def _get_record(self, session_id, keep=True):
+        with self.lock:
+            if (record := self.sessions.get(session_id)) is not None:
+                if self.working_set_size and keep:
+                    self.sessions[session_id] = self.sessions.pop(session_id)
+                return record
+            if session_id not in self.summaries:
+                return None
+            with self.unsaved_lock:
+                record = self.unsaved.get(session_id)
+            if record is None:
+                if (session := self.store.get(session_id)) is None:
+                    return None
+                record = compact(load_model(Session, session), self._share_uuid)
+            if keep:
+                self._index_session(record)
+            return record
+
+    # (session ID, item record) for the item or action ID in index (self.items or self.actions).
+    # Only sessions in memory are indexed, a session outside the working set is found in self.locations and read.
+    def _find(self, index, key):
+        with self.lock:
+            if key not in index and (session_id := self.locations.get(key)) is not None:
+                self._get_record(session_id)
+            return index.get(key)
+
+    # Read the session of a MultiAction outside the working set, registering its actions. The loader of the actions
+    # registry (see ActionsHandler.load_action), returns whether the session was found.
+    def load_action(self, action_id):
+        return self._find(self.actions, action_id) is not None
+
+    # Compare the indexes against the sessions themselves, returns a list of inconsistencies (empty if there are none)
+    def check_indexes(self):
+        errors = []
+        items = {}
+        actions = {}
+        for session_id, session in self.sessions.items():
+            if session.ID != session_id:
+                errors.append(f"Session {session.ID} is indexed as {session_id}")
+            summary = self._summarise(session, None)
+            if session_id not in self.summaries or \
+                    self._summary_fields(self.summaries[session_id]) != self._summary_fields(summary) or \
+                    any(self.summaries[session_id][key] != summary[key] for key in ["Items", "Actions"]):
+                errors.append(f"Session {session_id} doesn't match its summary")
+            for session_item in session.Items:
+                if session_item.ID in items:
+                    errors.append(f"Item {session_item.ID} appears more than once")
+                items[session_item.ID] = (session_id, session_item)
+                for action in session_item.Actions:
+                    if action.ID in actions:
+                        errors.append(f"Action {action.ID} appears more than once")
+                    actions[action.ID] = (session_id, session_item)
+        if self.working_set_size and len(self.sessions) > self.working_set_size:
+            errors.append("The working set has more sessions than it should")
+        if not self.working_set_size and self.sessions.keys() != self.summaries.keys():
+            errors.append("The summaries don't match the sessions")
+        locations = {key: session_id for session_id, summary in self.summaries.items()
+                     for key in summary['Items'] + summary['Actions']}
+        if locations != self.locations:
+            errors.append("The item and action locations don't match the summaries")
+        for session_id, summary in self.summaries.items():
+            if session_id not in self.names.get(summary['Name'], []):
+                errors.append(f"Session {session_id} is missing from the name index")
+        if sum(len(ids) for ids in self.names.values()) != len(self.summaries):
+            errors.append("The name index has sessions that don't exist")
+        if self.sorted_keys != sorted((summary['Name'], str(session_id)) for session_id, summary in self.summaries.items()):
+            errors.append("The sort order doesn't match the sessions")
+        for index, found, name in [(self.items, items, "Item"), (self.actions, actions, "Action")]:
+            for key in index.keys() | found.keys():
+                if key not in found or key not in index or \
+                        index[key][0] != found[key][0] or index[key][1] is not found[key][1]:
+                    errors.append(f"{name} {key} is indexed incorrectly")
+        return errors
+
+    # Add the sessions missing from the search index to it, reading those that aren't in memory.
+    # Sessions are indexed one at a time under the lock, so a session changed meanwhile isn't indexed as it was.
+    def index_sessions(self):
+        for session_id in list(self.unindexed):
+            with self.lock:
+                if session_id not in self.unindexed:
+                    continue
+                if (record := self._get_record(session_id, keep=False)) is not None:
+                    self.search.set_documents(session_id, session_documents(record))
+                self.unindexed.discard(session_id)
+
+    # Build the search index in the background after startup, rather than on the first search
+    def start_indexing(self):
+        Thread(target=self.index_sessions, daemon=True).start()
+
+    def get_statistics(self):
+        return {'sessions': len(self.summaries), 'in_memory': len(self.sessions), 'working_set': self.working_set_size}
+
+    # Writes the sessions in memory, the others haven't changed since they were read
+    def save_sessions(self, durable=False):
+        for session in self.sessions.values():
+            self.save_session(session)
+        if durable:
+            self.persistence.flush()
+
+    # Only the given session (record) is written to storage (on the next flush, right away if durable)
+    def save_session(self, session, durable=False):
+        modified = self.summaries[session.ID]['Modified'] = time.time()
+        self.changes.changed('sessions', session.ID)
+        with self.unsaved_lock:
+            self.unsaved[session.ID] = session
+        self.persistence.mark_dirty(('session', session.ID), lambda: self._write_session(session, modified))
+        self.persistence.mark_dirty('sessions_index', self.store.save_index, durable)
+
+    def _write_session(self, session, modified):
+        self.store.save(expand(session), modified)
+        with self.unsaved_lock:
+            if self.unsaved.get(session.ID) is session:
+                del self.unsaved[session.ID]
+
+    def _delete_session(self, session_id, durable=False):
+        self.changes.removed('sessions', session_id)
+        with self.unsaved_lock:
+            self.unsaved.pop(session_id, None)
+        self.persistence.mark_dirty(('session', session_id), lambda: self.store.remove(session_id))
+        self.persistence.mark_dirty('sessions_index', self.store.save_index, durable)
 
     async def dict_to_session_rename(self, session):
         zero = UUID('00000000-0000-0000-0000-000000000000')
@@ -100,86 +499,281 @@ class SessionsHandler:
                     primary_action = False
 
                 action_objects.append(fixed_action)
-                self.actions_master.add_action(fixed_action)
-                self.actions_master.add_actions(fixed_action.get_children())
             session_item['Actions'] = action_objects
 
     def _link_motions(self, session):
         for session_item in session.Items:
             for action in session_item.Actions:
-                if (handler_action := self.motions_master.get_motion_by_name(action.MotionItem.Name)) is not None:
-                    action.MotionItem.ID = handler_action.ID
-                    action.MotionItem.Group = handler_action.Group
-                    action.MotionItem.FilePath = handler_action.FilePath
-                else:
-                    action.MotionItem.flash()
+                self._link_motion(action)
+
+    def _link_motion(self, action):
+        if (handler_action := self.motions_master.get_motion_by_name(action.MotionItem.Name)) is not None:
+            action.MotionItem.ID = handler_action.ID
+            action.MotionItem.Group = handler_action.Group
+            action.MotionItem.FilePath = handler_action.FilePath
+        else:
+            action.MotionItem.flash()
 
+    # Sessions read from storage for these aren't kept in the working set
     def get_sessions(self):
-        return {"sessions": self.sessions}
+        records = [self._get_record(session_id, keep=False) for session_id in list(self.summaries)]
+        return {"sessions": [expand(record) for record in records if record is not None]}
 
+    # Sorted by name (sessions with the same name by ID)
     def get_sorted_sessions(self):
-        return {'sessions': sorted(self.sessions, key=lambda x: x.Name)}
-
-    def get_session(self, ID):
-        return next((x for x in self.sessions if x.ID == ID), None)
-
+        records = [self._get_record(UUID(session_id), keep=False) for _, session_id in list(self.sorted_keys)]
+        return {'sessions': [expand(record) for record in records if record is not None]}
+
+    # keep: see _get_record()
+    def get_session(self, ID, keep=True):
+        record = self._get_record(ID, keep)
+        return expand(record) if record is not None else None
+
+    def get_session_summary(self, session_id):
+        summary = self.summaries[session_id]
+        return {"ID": session_id,
+                **self._summary_fields(summary),
+                "Modified": datetime.fromtimestamp(summary['Modified'], timezone.utc).isoformat()}
+
+    # A page of session summaries in the order of get_sorted_sessions, optionally only those whose name starts with
+    # prefix (case-sensitive). cursor is the next_cursor of the previous page, None for the first page.
+    def get_session_summaries(self, limit, cursor=None, prefix=""):
+        start = 0
+        end = len(self.sorted_keys)
+        if prefix:
+            start = bisect_left(self.sorted_keys, (prefix,))
+            # The first key after every name starting with prefix
+            end = bisect_left(self.sorted_keys, (prefix[:-1] + chr(ord(prefix[-1]) + 1),))
+        total = end - start
+        if cursor:
+            try:
+                after = json.loads(urlsafe_b64decode(cursor.encode()))
+            except (ValueError, TypeError):
+                return {'error': 'Invalid cursor!'}
+            # A cursor is a (Name, ID) key of self.sorted_keys
+            if not isinstance(after, list) or len(after) != 2 or not all(isinstance(part, str) for part in after):
+                return {'error': 'Invalid cursor!'}
+            after = tuple(after)
+            start = max(start, bisect_right(self.sorted_keys, after))
+
+        keys = self.sorted_keys[start:min(start + limit, end)]
+        next_cursor = None
+        if keys and start + limit < end:
+            next_cursor = urlsafe_b64encode(json.dumps(keys[-1]).encode()).decode()
+        return {"sessions": [self.get_session_summary(UUID(session_id)) for _, session_id in keys],
+                "total": total,
+                "next_cursor": next_cursor}
+
+    # The first session with the given name
+    def get_session_by_name(self, name):
+        return self.get_session(self.names[name][0]) if name in self.names else None
+
+    # Position of the session in get_sorted_sessions()
     def get_session_index(self, ID):
-        for index, session in enumerate(self.get_sorted_sessions()['sessions']):
-            if session.ID == UUID(ID):
-                return index
-        return None
+        session_id = UUID(str(ID))
+        if (summary := self.summaries.get(session_id)) is None:
+            return None
+        return bisect_left(self.sorted_keys, (summary['Name'], str(session_id)))
 
     def get_session_item(self, ID):
-        for session in self.sessions:
-            for item in session.Items:
-                if item.ID == ID:
-                    return {'session_item': item}
+        if (found := self._find(self.items, ID)) is not None:
+            return {'session_item': expand(found[1])}
         return {'error': f"Item with ID {ID} wasn't found!"}
 
     # Requires a dict-based session with no Action/SessionItem/etc. objects
     async def import_session(self, session):
         await self.dict_to_session_rename(session)
-        self.sessions.append(Session.parse_obj(session))
-        self.save_sessions()
-
-    def add_session_actions_to_action_master(self, session, overwrite=False):
-        for session_item in session.Items:
-            primary_action = True
-            for action in session_item.Actions:
-                if primary_action:
-                    action.PrimaryAction = True
-                    primary_action = False
-                self.actions_master.add_action(action, overwrite=overwrite)
-                for child_action in action.get_children():
-                    self.actions_master.add_action(child_action, overwrite=overwrite)
+        with self.lock:
+            self.save_session(self._set_session(Session.parse_obj(session)))
 
     def update_session(self, ID, updated_session):
-        for index, session in enumerate(self.sessions):
-            if session.ID == ID:
-                self._link_motions(updated_session)
-                session_cleanup(updated_session)
-                self.sessions[index] = updated_session
-                self.add_session_actions_to_action_master(updated_session, overwrite=True)
-                self.save_sessions()
-                return {'message': 'Session updated!'}
-        return {'error': f"Couldn't find session {ID}!"}
+        with self.lock:
+            if ID not in self.summaries:
+                return {'error': f"Couldn't find session {ID}!"}
+            self._link_motions(updated_session)
+            session_cleanup(updated_session)
+            if updated_session.ID != ID:
+                # A different session with the new ID is replaced by _set_session()
+                self.remove_session(ID)
+            self.save_session(self._set_session(updated_session))
+            return {'message': 'Session updated!'}
+
+    # Apply the operations (see SessionOperation) in order, all of them or none if one of them fails.
+    # Only the questions they change are compacted, indexed and have their actions registered again, the others are
+    # shared with the previous record. The session is written to storage as a whole, like any change.
+    def patch_session(self, ID, operations):
+        with self.lock:
+            if (record := self._get_record(ID)) is None:
+                return {'error': f"Couldn't find session {ID}!"}
+            # Questions of the session as records, or models for those the operations change
+            items = list(record.Items)
+            for number, operation in enumerate(operations):
+                if (error := self._apply_operation(ID, items, operation)) is not None:
+                    return {'error': f"Operation {number}: {error}"}
+
+            for session_item in items:
+                if not isinstance(session_item, Record):
+                    _set_primary_actions(session_item)
+            items = tuple(session_item if isinstance(session_item, Record) else compact(session_item, self._share_uuid)
+                          for session_item in items)
+            kept = {id(session_item) for session_item in items}
+            removed = [session_item for session_item in record.Items if id(session_item) not in kept]
+            previous = {id(session_item) for session_item in record.Items}
+            added = [session_item for session_item in items if id(session_item) not in previous]
+
+            session = replace(record, Items=items)
+            self.sessions[ID] = session
+            for session_item in removed:
+                self._unindex_item(session_item)
+            for session_item in added:
+                self._index_item(ID, session_item)
+            self.actions_master.add_actions(ID, [action for session_item in added
+                                                 for action in item_actions(session_item)],
+                                            removed={action.ID for session_item in removed
+                                                     for action in item_actions(session_item)})
+            if ID not in self.unindexed:
+                removed_ids = {session_item.ID for session_item in removed} | \
+                    {action.ID for session_item in removed for action in session_item.Actions}
+                self.search.change_documents(ID, [document for session_item in added
+                                                  for document in item_documents(session, session_item)],
+                                             removed=removed_ids)
+            self.media_master.set_references(ID, session_media_paths(session))
+            self._unlocate(ID, self.summaries[ID])
+            self.summaries[ID] = self._summarise(session, self.summaries[ID]['Modified'])
+            self._locate(ID, self.summaries[ID])
+            self.save_session(session)
+            return {'message': 'Session updated!'}
+
+    # Apply the operation to the items of the session (see patch_session), returns an error message if it can't be
+    # applied
+    def _apply_operation(self, session_id, items, operation):
+        if operation.Op == 'add':
+            if operation.Item is not None:
+                item_cleanup(operation.Item)
+                if _item_position(items, operation.Item.ID) is not None:
+                    return f"Item {operation.Item.ID} already exists!"
+                if (error := _position_error(operation.Position, len(items))) is not None:
+                    return error
+                if (error := _duplicate_action_error(items, operation.Item.Actions) or
+                        self._foreign_action_error(session_id, operation.Item.Actions)) is not None:
+                    return error
+                for action in operation.Item.Actions:
+                    self._link_motion(action)
+                items.insert(len(items) if operation.Position is None else operation.Position, operation.Item)
+            elif operation.Action is not None:
+                if (item_position := _item_position(items, operation.ItemID)) is None:
+                    return f"Item {operation.ItemID} wasn't found!"
+                action_cleanup(operation.Action)
+                if (error := _position_error(operation.Position, len(items[item_position].Actions))) is not None:
+                    return error
+                if (error := _duplicate_action_error(items, [operation.Action]) or
+                        self._foreign_action_error(session_id, [operation.Action])) is not None:
+                    return error
+                self._link_motion(operation.Action)
+                actions = _changeable_item(items, item_position).Actions
+                actions.insert(len(actions) if operation.Position is None else operation.Position, operation.Action)
+            else:
+                return "An Item or an Action is required!"
+            return None
+
+        item_position = _item_position(items, operation.ID)
+        action_position = _action_position(items, operation.ID) if item_position is None else None
+        if item_position is None and action_position is None:
+            return f"Item or action {operation.ID} wasn't found!"
+        if operation.Op == 'replace':
+            if item_position is not None and operation.Item is not None:
+                operation.Item.ID = operation.ID
+                item_cleanup(operation.Item)
+                if (error := _duplicate_action_error(items, operation.Item.Actions, item_position) or
+                        self._foreign_action_error(session_id, operation.Item.Actions)) is not None:
+                    return error
+                for action in operation.Item.Actions:
+                    self._link_motion(action)
+                items[item_position] = operation.Item
+            elif action_position is not None and operation.Action is not None:
+                operation.Action.ID = operation.ID
+                action_cleanup(operation.Action)
+                self._link_motion(operation.Action)
+                _changeable_item(items, action_position[0]).Actions[action_position[1]] = operation.Action
+            else:
+                return f"{'An Item' if item_position is not None else 'An Action'} is required!"
+        elif operation.Op == 'move':
+            if item_position is not None:
+                if operation.Position is None:
+                    return "A Position is required!"
+                if (error := _position_error(operation.Position, len(items) - 1)) is not None:
+                    return error
+                items.insert(operation.Position, items.pop(item_position))
+            else:
+                target = action_position[0]
+                if operation.ItemID is not None and (target := _item_position(items, operation.ItemID)) is None:
+                    return f"Item {operation.ItemID} wasn't found!"
+                # The action is taken out of the target question first if it's already there
+                last = len(items[target].Actions) - (target == action_position[0])
+                if (error := _position_error(operation.Position, last)) is not None:
+                    return error
+                action = _changeable_item(items, action_position[0]).Actions.pop(action_position[1])
+                actions = _changeable_item(items, target).Actions
+                actions.insert(len(actions) if operation.Position is None else operation.Position, action)
+        elif item_position is not None:
+            del items[item_position]
+        else:
+            del _changeable_item(items, action_position[0]).Actions[action_position[1]]
+        return None
+
+    # Error message if one of the actions has the ID of an action of another session or a shortcut (the owners in the
+    # actions registry, or the summaries for sessions outside the working set), None otherwise
+    def _foreign_action_error(self, session_id, actions):
+        for action in actions:
+            if self.actions_master.get_owners(action.ID) - {session_id} or \
+                    self.locations.get(action.ID, session_id) != session_id:
+                return f"Action {action.ID} belongs to another session or shortcut!"
+        return None
+
+    # Attach synthesized audio to a stored session, file_paths being {utterance ID: (phrase, file path)}.
+    # Utterances whose phrase has changed since the synthesis was requested are left untouched, their IDs and those of
+    # removed utterances are listed as unattached.
+    def set_utterance_files(self, session_id, file_paths):
+        with self.lock:
+            session = self.get_session(session_id)
+            if session is None:
+                return {'error': f"Couldn't find session {session_id}!"}
+            attached = set()
+            for session_item in session.Items:
+                for action in session_item.Actions:
+                    utterance = action.UtteranceItem
+                    if utterance and utterance.ID in file_paths:
+                        phrase, file_path = file_paths[utterance.ID]
+                        if utterance.synthesis_phrase() == phrase:
+                            utterance.FilePath = file_path
+                            attached.add(utterance.ID)
+            self.save_session(self._set_session(session))
+            return {'message': 'Session audio updated!',
+                    'unattached': [utterance_id for utterance_id in file_paths if utterance_id not in attached]}
 
     def add_session(self, session):
-        self._link_motions(session)
-        session_cleanup(session)
-        self.add_session_actions_to_action_master(session)
-        self.sessions.append(session)
-        self.save_sessions()
+        with self.lock:
+            self._link_motions(session)
+            session_cleanup(session)
+            self.save_session(self._set_session(session))
 
     def remove_session(self, session_id):
-        self.sessions = list(filter(lambda x: x.ID != session_id, self.sessions))
-        self.save_sessions()
+        with self.lock:
+            if (session := self.sessions.get(session_id)) is not None:
+                self._unindex_session(session)
+            if session_id in self.summaries:
+                self._unindex_summary(session_id)
+            self.search.release(session_id)
+            self.unindexed.discard(session_id)
+            self.media_master.release(session_id)
+            self._delete_session(session_id)
 
     def remove_action(self, action_id):
-        for session in self.sessions:
+        with self.lock:
+            if (found := self._find(self.actions, action_id)) is None:
+                return {'error': f'No action with ID {action_id}'}
+            session = expand(self.sessions[found[0]])
             for session_item in session.Items:
-                for action in session_item.Actions:
-                    if action.ID == action_id:
-                        session_item.Actions.remove(action)
-                        return {'message': 'Action removed!'}
-        return {'error': f'No action with ID {action_id}'}
+                session_item.Actions = [action for action in session_item.Actions if action.ID != action_id]
+            self.save_session(self._set_session(session))
+            return {'message': 'Action removed!'}
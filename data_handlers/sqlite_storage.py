@@ -0,0 +1,180 @@
+import os
+import time
+import orjson
+import sqlite3
+
+from uuid import uuid4
+from threading import Lock
+from contextlib import contextmanager
+
+from fastapi.encoders import jsonable_encoder
+
+from data_handlers.storage import JSONSessionStore, JSONCollectionStore, session_summary, read_json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    description TEXT,
+    item_count INTEGER,
+    modified REAL,
+    media TEXT,
+    item_ids TEXT,
+    action_ids TEXT
+);
+CREATE TABLE IF NOT EXISTS items (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (collection, id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+# A single SQLite database file (WAL mode) shared by the stores below.
+# The connection is shared between threads, the lock makes sure only one of them uses it at a time.
+class SQLiteDatabase:
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, a crash can only lose the last transactions, never corrupt the database
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    # Everything executed within is committed together, or not at all
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def get_meta(self, key):
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key, value):
+        with self.transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# Same interface as JSONSessionStore, each session is a row
+class SQLiteSessionStore:
+    def __init__(self, database):
+        self.database = database
+
+    def load_all(self):
+        return [orjson.loads(data) for data, in self.database.query("SELECT data FROM sessions ORDER BY rowid")]
+
+    # A primary key lookup, sessions outside the working set are read with it (see SESSION_WORKING_SET in config.py)
+    def get(self, session_id):
+        rows = self.database.query("SELECT data FROM sessions WHERE id = ?", (str(session_id),))
+        return orjson.loads(rows[0][0]) if rows else None
+
+    def summaries(self):
+        summaries = {}
+        for session_id, name, description, item_count, modified, media, item_ids, action_ids in self.database.query(
+                "SELECT id, name, description, item_count, modified, media, item_ids, action_ids FROM sessions "
+                "ORDER BY rowid"):
+            summaries[session_id] = {"Name": name, "Description": description, "ItemCount": item_count,
+                                     "Modified": modified, "Media": orjson.loads(media),
+                                     "Items": orjson.loads(item_ids), "Actions": orjson.loads(action_ids)}
+        return summaries
+
+    def save(self, session, modified=None):
+        session = jsonable_encoder(session)
+        summary = session_summary(session, modified or time.time())
+        with self.database.transaction() as connection:
+            connection.execute("INSERT INTO sessions (id, name, data, description, item_count, modified, media, "
+                               "item_ids, action_ids) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                               "ON CONFLICT (id) DO UPDATE SET name = excluded.name, "
+                               "data = excluded.data, description = excluded.description, "
+                               "item_count = excluded.item_count, modified = excluded.modified, "
+                               "media = excluded.media, item_ids = excluded.item_ids, action_ids = excluded.action_ids",
+                               (session['ID'], session['Name'], orjson.dumps(session).decode(), summary['Description'],
+                                summary['ItemCount'], summary['Modified'], orjson.dumps(summary['Media']).decode(),
+                                orjson.dumps(summary['Items']).decode(), orjson.dumps(summary['Actions']).decode()))
+
+    def remove(self, session_id):
+        with self.database.transaction() as connection:
+            connection.execute("DELETE FROM sessions WHERE id = ?", (str(session_id),))
+
+    # Every change is already committed, there's no separate index to write
+    def save_index(self):
+        pass
+
+
+# Same interface as JSONCollectionStore, each item is a row.
+# Saving the list only writes the rows that changed since they were last loaded or saved.
+class SQLiteCollectionStore:
+    def __init__(self, database, collection):
+        self.database = database
+        self.collection = collection
+        # Item ID -> (position, JSON) as currently stored
+        self.stored = {}
+
+    def load(self):
+        rows = self.database.query("SELECT id, position, data FROM items WHERE collection = ? ORDER BY position",
+                                   (self.collection,))
+        self.stored = {item_id: (position, data) for item_id, position, data in rows}
+        return [orjson.loads(data) for _, _, data in rows]
+
+    def save(self, items):
+        rows = {}
+        for position, item in enumerate(jsonable_encoder(items)):
+            rows[item['ID']] = (position, item.get('Name') or item.get('Phrase'), orjson.dumps(item).decode())
+
+        with self.database.transaction() as connection:
+            for item_id, (position, name, data) in rows.items():
+                if self.stored.get(item_id) != (position, data):
+                    connection.execute("INSERT OR REPLACE INTO items (collection, id, name, position, data) "
+                                       "VALUES (?, ?, ?, ?, ?)", (self.collection, item_id, name, position, data))
+            for item_id in self.stored.keys() - rows.keys():
+                connection.execute("DELETE FROM items WHERE collection = ? AND id = ?", (self.collection, item_id))
+        self.stored = {item_id: (position, data) for item_id, (position, _, data) in rows.items()}
+
+
+# One-shot import of the JSON storage into the database, done the first time the SQLite engine is used.
+# Sessions come from the per-session files or, if there are none, the old single file (data/sessions.json).
+# collection_files is {collection: JSON file path}. The JSON files are left as they were.
+# Every save is idempotent, so an interrupted migration is simply redone on the next start.
+def migrate_json_to_sqlite(database, sessions_folder, legacy_sessions_file, collection_files):
+    if database.get_meta("migrated_from_json"):
+        return
+
+    session_store = SQLiteSessionStore(database)
+    # JSONSessionStore() would create the folder or split the old file, it's only used if there's an index to read
+    if os.path.isfile(os.path.join(sessions_folder, "index.json")):
+        json_store = JSONSessionStore(sessions_folder)
+        summaries = json_store.summaries()
+        for session in json_store.load_all():
+            session_store.save(session, summaries.get(session['ID'], {}).get('Modified'))
+    elif os.path.isfile(legacy_sessions_file):
+        for session in read_json(legacy_sessions_file)['sessions']:
+            if not session.get('ID'):
+                session['ID'] = str(uuid4())
+            session_store.save(session)
+    for collection, path in collection_files.items():
+        SQLiteCollectionStore(database, collection).save(JSONCollectionStore(path, collection).load())
+    database.set_meta("migrated_from_json", "1")
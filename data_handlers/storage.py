@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import orjson
+import logging
+import tempfile
+
+from uuid import UUID, uuid4
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST
+from fastapi.encoders import jsonable_encoder
+
+from config import TRUSTED_LOAD
+
+
+# Write a file through a temporary file and a rename, so a crash never leaves it half-written
+def atomic_write(path, text):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_json(path):
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+# Build a model from data this server has saved itself without validating it, validation being the bulk of the
+# startup time. Nested models (and lists of them) are built the same way, UUIDs and floats converted, other values
+# used as they are.
+def construct_trusted(model, data):
+    values = {}
+    fields_set = set()
+    for name, convert, is_list, field in _construct_plan(model):
+        if name not in data:
+            values[name] = field.get_default()
+            continue
+        value = data[name]
+        if value is not None and convert is not None:
+            value = [convert(item) for item in value] if is_list else convert(value)
+        values[name] = value
+        fields_set.add(name)
+    # What BaseModel.construct() does, without its per-field overhead
+    instance = model.__new__(model)
+    object.__setattr__(instance, '__dict__', values)
+    object.__setattr__(instance, '__fields_set__', fields_set)
+    return instance
+
+
+_construct_plans = {}
+
+
+# (field name, converter or None, whether the field is a list, field) for each field of the model, worked out once per model
+def _construct_plan(model):
+    if model not in _construct_plans:
+        plan = []
+        for name, field in model.__fields__.items():
+            convert = None
+            if isinstance(field.type_, type):
+                if issubclass(field.type_, BaseModel):
+                    convert = _model_converter(field.type_)
+                elif field.type_ is UUID:
+                    convert = _to_uuid
+                elif field.type_ is float:
+                    convert = float
+            plan.append((name, convert, field.shape == SHAPE_LIST, field))
+        _construct_plans[model] = plan
+    return _construct_plans[model]
+
+
+def _model_converter(model):
+    return lambda value: construct_trusted(model, value)
+
+
+def _to_uuid(value):
+    return value if isinstance(value, UUID) else UUID(value)
+
+
+# Model from stored data (see TRUSTED_LOAD in config.py)
+def load_model(model, data):
+    return construct_trusted(model, data) if TRUSTED_LOAD else model.parse_obj(data)
+
+
+# Fields listed for each session without loading all of them, modified being a UNIX timestamp.
+# Media is the media files the session references, Items and Actions the IDs of its questions and MultiActions.
+def session_summary(session, modified):
+    return {"Name": session['Name'],
+            "Description": session.get('Description'),
+            "ItemCount": len(session['Items']),
+            "Modified": modified,
+            "Media": session_media(session),
+            "Items": [session_item['ID'] for session_item in session['Items']],
+            "Actions": [action['ID'] for session_item in session['Items'] for action in session_item['Actions']]}
+
+
+# The media file paths of a stored session, see session_media_paths in session.py
+def session_media(session):
+    return sorted({child['FilePath'] for session_item in session['Items'] for action in session_item['Actions']
+                   for child in [action.get('UtteranceItem'), action.get('ImageItem')] if child and child.get('FilePath')})
+
+
+# Sessions stored one per file (<folder>/<ID>.json) along with a small index of all sessions,
+# so changing a session only rewrites that session's file and the index.
+# The index also holds a summary of each session (see session_summary), so sessions can be listed without reading them.
+# save() and remove() only update the index in memory, it's written with save_index().
+class JSONSessionStore:
+    def __init__(self, folder, legacy_file=None):
+        self.folder = folder
+        self.index_file = os.path.join(folder, "index.json")
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
+
+        # Session ID (str) -> summary (see session_summary)
+        if os.path.isfile(self.index_file):
+            self.index = read_json(self.index_file)['sessions']
+        else:
+            self.index = {}
+            if legacy_file and os.path.isfile(legacy_file):
+                self._migrate(legacy_file)
+            else:
+                self.save_index()
+
+    # Split the old single-file storage (data/sessions.json) into per-session files, keep the old file as a backup
+    def _migrate(self, legacy_file):
+        with open(legacy_file) as f:
+            for session in json.load(f)['sessions']:
+                if not session.get('ID'):
+                    session['ID'] = str(uuid4())
+                self._write(session)
+        self.save_index()
+        os.replace(legacy_file, legacy_file + ".migrated")
+
+    def _path(self, session_id):
+        return os.path.join(self.folder, f"{session_id}.json")
+
+    def save_index(self):
+        atomic_write(self.index_file, json.dumps({"sessions": self.index}))
+
+    def _write(self, session, modified=None):
+        session = jsonable_encoder(session)
+        atomic_write(self._path(session['ID']), json.dumps(session))
+        self.index[session['ID']] = session_summary(session, modified or time.time())
+
+    def load_all(self):
+        sessions = []
+        for session_id in self.index:
+            # The index may be written ahead of a session file that didn't make it to disk
+            if not os.path.isfile(self._path(session_id)):
+                logging.warning(f"Session {session_id} is listed in the index but its file is missing")
+                continue
+            sessions.append(read_json(self._path(session_id)))
+        return sessions
+
+    def get(self, session_id):
+        if str(session_id) not in self.index or not os.path.isfile(self._path(session_id)):
+            return None
+        return read_json(self._path(session_id))
+
+    # Session ID (str) -> summary (see session_summary)
+    def summaries(self):
+        return dict(self.index)
+
+    def save(self, session, modified=None):
+        self._write(session, modified)
+
+    def remove(self, session_id):
+        self.index.pop(str(session_id), None)
+        if os.path.isfile(self._path(session_id)):
+            os.remove(self._path(session_id))
+
+
+# A list of items (shortcuts, motions) stored in a single JSON file as {key: [...]}
+class JSONCollectionStore:
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return []
+        return read_json(self.path)[self.key]
+
+    def save(self, items):
+        atomic_write(self.path, json.dumps({self.key: jsonable_encoder(items)}))
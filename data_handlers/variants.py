@@ -0,0 +1,156 @@
+import os
+import wave
+import tempfile
+
+from config import ROBOT_AUDIO_SAMPLE_RATE, ROBOT_AUDIO_RMS, ROBOT_AUDIO_PEAK, TABLET_IMAGE_SIZE, THUMBNAIL_SIZE, \
+    IMAGE_QUALITY
+
+
+# NumPy and Pillow are imported where they're used, importing them on startup takes long on the Raspberry Pi
+
+# Derived files are stored next to their original, e.g. data/uploads/<hash>_robot.wav
+def variant_path(filepath, variant, extension):
+    return f"{filepath.rsplit('.', 1)[0]}_{variant}.{extension}"
+
+
+# A variant is rebuilt once its original is replaced (e.g. speech synthesized again under the same name)
+def is_current(target, filepath):
+    return os.path.isfile(target) and os.path.getmtime(target) >= os.path.getmtime(filepath)
+
+
+# Write a variant through a temporary file of its own with write(file), so a variant created by two threads at once is
+# never replaced by a partly written file
+def _write_variant(target, write):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target) or ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def robot_audio_path(filepath):
+    return variant_path(filepath, "robot", "wav")
+
+
+# PCM frames to floats in [-1, 1], one column per channel
+def _decode_frames(frames, sample_width, channels):
+    import numpy as np
+    if sample_width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 2 ** 15
+    elif sample_width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = (raw[:, 0] | raw[:, 1] << 8 | raw[:, 2] << 16)
+        samples = np.where(samples >= 2 ** 23, samples - 2 ** 24, samples).astype(np.float32) / 2 ** 23
+    elif sample_width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2 ** 31
+    else:
+        raise wave.Error(f"Unsupported sample width {sample_width}")
+    return samples.reshape(-1, channels)
+
+
+# Band-limited resampling in the frequency domain, avoids aliasing when downsampling
+def _resample(samples, source_rate, target_rate):
+    import numpy as np
+    if source_rate == target_rate or len(samples) < 2:
+        return samples
+    target_length = max(1, round(len(samples) * target_rate / source_rate))
+    spectrum = np.fft.rfft(samples)
+    bins = target_length // 2 + 1
+    if bins <= len(spectrum):
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros(bins - len(spectrum), dtype=spectrum.dtype)])
+    return np.fft.irfft(spectrum, n=target_length) * target_length / len(samples)
+
+
+# Scale to the target loudness without letting peaks exceed the target peak level
+def _normalise(samples):
+    import numpy as np
+    peak = np.max(np.abs(samples)) if len(samples) else 0
+    if peak == 0:
+        return samples
+    rms = np.sqrt(np.mean(samples ** 2))
+    gain = min(ROBOT_AUDIO_RMS / rms, ROBOT_AUDIO_PEAK / peak)
+    return samples * gain
+
+
+# Create (or reuse if it's current) a mono, fixed-rate, normalised 16-bit copy of a WAV file for the robot to play.
+# Files that can't be read as PCM WAV are served as they are, so the original path is returned.
+def robot_audio(filepath):
+    import numpy as np
+    if not filepath or not os.path.isfile(filepath):
+        return filepath
+    target = robot_audio_path(filepath)
+    if is_current(target, filepath):
+        return target
+
+    try:
+        with wave.open(filepath, "rb") as source:
+            channels = source.getnchannels()
+            sample_rate = source.getframerate()
+            samples = _decode_frames(source.readframes(source.getnframes()), source.getsampwidth(), channels)
+    except (wave.Error, EOFError, ValueError):
+        return filepath
+
+    samples = _normalise(_resample(samples.mean(axis=1), sample_rate, ROBOT_AUDIO_SAMPLE_RATE))
+    frames = (np.clip(samples, -1, 1) * (2 ** 15 - 1)).astype("<i2").tobytes()
+
+    def write(f):
+        with wave.open(f, "wb") as robot_file:
+            robot_file.setnchannels(1)
+            robot_file.setsampwidth(2)
+            robot_file.setframerate(ROBOT_AUDIO_SAMPLE_RATE)
+            robot_file.writeframes(frames)
+
+    _write_variant(target, write)
+    return target
+
+
+# Create (or reuse if it's current) a copy of an image scaled down to fit within size, re-encoded as JPEG (PNG if it
+# has transparency).
+# Images that already fit, animations and unreadable files are used as they are, so the original path is returned.
+def _image_variant(filepath, variant, size):
+    from PIL import Image, ImageOps
+    if not filepath or not os.path.isfile(filepath):
+        return filepath
+    for extension in ["jpg", "png"]:
+        if is_current(target := variant_path(filepath, variant, extension), filepath):
+            return target
+
+    try:
+        with Image.open(filepath) as image:
+            if getattr(image, "is_animated", False):
+                return filepath
+            if image.width <= size[0] and image.height <= size[1] and image.format in ["JPEG", "PNG"]:
+                return filepath
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(size)
+            if image.mode in ["RGBA", "LA"] or "transparency" in image.info:
+                image, extension, options = image.convert("RGBA"), "png", {"optimize": True}
+            else:
+                image, extension, options = image.convert("RGB"), "jpg", {"quality": IMAGE_QUALITY, "optimize": True}
+            target = variant_path(filepath, variant, extension)
+            _write_variant(target, lambda f: image.save(f, format="PNG" if extension == "png" else "JPEG", **options))
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return filepath
+    return target
+
+
+# The image sent to Pepper's tablet
+def tablet_image(filepath):
+    return _image_variant(filepath, "tablet", TABLET_IMAGE_SIZE)
+
+
+# Preview for the web client
+def thumbnail_image(filepath):
+    return _image_variant(filepath, "thumb", THUMBNAIL_SIZE)
+
+
+def image_variants(filepath):
+    return {"tablet": tablet_image(filepath), "thumbnail": thumbnail_image(filepath)}
@@ -16,48 +16,68 @@ Recording:
 sudo apt install portaudio19-dev
 
 TODO: Migrate to Python3.9 (Debian has issues using older Python versions than default, the new Raspberries use 3.9?)
-TODO: Unlinked files persist. Cleanup on server shutdown, move unlinked files to different folder
 TODO: Front expects a json-message as response to POST requests (e.g session adding). (partially?) Use status codes instead?
 TODO: Unlink images/audio/motions
 """
 import subprocess
 
 from uuid import UUID, uuid4
-from zipfile import ZipFile
-from tempfile import TemporaryFile
+from urllib.parse import quote
+from datetime import datetime
 
-from typing import Union
-from fastapi import FastAPI, Form, Path, Body, WebSocket, Request
+from typing import Union, List
+from fastapi import FastAPI, Form, Path, Body, Query, WebSocket, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, validator
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
+from pydantic import BaseModel, ValidationError, validator
 
 from config import *
 from recordingManager import RecordingManager
-from data_handlers.audio import AudioShortcutsHandler
+from data_handlers.audio import AudioShortcutsHandler, AudioShortcutOperation
 from data_handlers.motion import MotionsHandler
-from data_handlers.action import ActionsHandler, ActionShortcutsHandler, MultiAction, UtteranceItem
-from data_handlers.session import SessionsHandler, Session
+from data_handlers.media import MediaHandler
+from data_handlers.changes import ChangeTracker
+from data_handlers.search import SearchIndex
+from data_handlers.storage import JSONSessionStore, JSONCollectionStore
+from data_handlers.sqlite_storage import SQLiteDatabase, SQLiteSessionStore, SQLiteCollectionStore, \
+    migrate_json_to_sqlite
+from data_handlers.action import ActionsHandler, ActionShortcutsHandler, ShortcutOperation, MultiAction, UtteranceItem, \
+    MotionItem
+from data_handlers.session import SessionsHandler, Session, SessionPatch, utterances_missing_audio, session_media_paths
 from pepperConnectionManager import PepperConnectionManager
 from recordingForwardingManager import RecordingForwardingManager
 from addressForwardingManager import AddressForwarder
+from synthesisManager import SynthesisManager
+from persistenceManager import PersistenceManager
 from data_handlers.file_operations import *
+from data_handlers.variants import robot_audio, image_variants, thumbnail_image
+from data_handlers.media import media_type
+from data_handlers.media_files import MediaFiles
 
 # Save file paths
-SESSIONS_FILE = "data/sessions.json"
+SESSIONS_FOLDER = "data/sessions"
+# Sessions used to be saved in a single file, it's migrated to SESSIONS_FOLDER on startup
+LEGACY_SESSIONS_FILE = "data/sessions.json"
 AUDIO_SHORTCUTS_FILE = "data/audio_shortcuts.json"
 ACTION_SHORTCUTS_FILE = "data/action_shortcuts.json"
 MOTIONS_FILE = "data/motions.json"
+# Used instead of the files above if STORAGE_ENGINE is "sqlite"
+SQLITE_DATABASE = "data/pepper.db"
 ADDITINAL_MOTIONS_FOLDER = "data/additional_motions"
+UPLOADS_FOLDER = "data/uploads"
+TRASH_FOLDER = "data/trash"
 
 # Create missing files/folders
 if not os.path.isdir('data'):
     os.mkdir('data')
-for subdir in ['additional_motions', 'recordings', 'uploads', 'compressed_sessions']:
+for subdir in ['additional_motions', 'recordings', 'uploads', 'compressed_sessions', 'trash']:
     if not os.path.isdir(os.path.join('data', subdir)):
         os.mkdir(os.path.join('data', subdir))
-for memory_file in [SESSIONS_FILE, AUDIO_SHORTCUTS_FILE, ACTION_SHORTCUTS_FILE, MOTIONS_FILE]:
+for memory_file in [AUDIO_SHORTCUTS_FILE, ACTION_SHORTCUTS_FILE, MOTIONS_FILE]:
     if not os.path.isfile(memory_file):
         with open(memory_file, "w") as f:
             f.write(json.dumps({os.path.basename(memory_file).rsplit(".", 1)[0]: []}))
@@ -78,6 +98,12 @@ tags_metadata = [
      "description": "Movements manipulation"},
     {"name": "Uploads",
      "description": "Session uploads"},
+    {"name": "Library",
+     "description": "Bulk export and import of sessions, shortcuts and motions"},
+    {"name": "Search",
+     "description": "Searching sessions and shortcuts"},
+    {"name": "Media",
+     "description": "Uploaded media storage"},
     {"name": "Synthesis",
      "description": "Calls to synthesize and save speech files via Neurokõne"},
     {"name": "Recording",
@@ -95,6 +121,8 @@ app = FastAPI(
     },
     openapi_tags=tags_metadata
 )
+# Uploads are served with caching and range request support, the mount must precede the general /data mount
+app.mount("/data/uploads", MediaFiles(directory=UPLOADS_FOLDER), name="uploads")
 app.mount("/data", StaticFiles(directory="data"), name="data")
 
 # Allowed origins (see https://fastapi.tiangolo.com/tutorial/cors/)
@@ -116,11 +144,36 @@ app.add_middleware(
 # del p
 
 # Helper objects
+if STORAGE_ENGINE == "sqlite":
+    database = SQLiteDatabase(SQLITE_DATABASE)
+    migrate_json_to_sqlite(database, SESSIONS_FOLDER, LEGACY_SESSIONS_FILE,
+                           {'audio_shortcuts': AUDIO_SHORTCUTS_FILE,
+                            'action_shortcuts': ACTION_SHORTCUTS_FILE,
+                            'motions': MOTIONS_FILE})
+    session_store = SQLiteSessionStore(database)
+    audio_store = SQLiteCollectionStore(database, 'audio_shortcuts')
+    action_store = SQLiteCollectionStore(database, 'action_shortcuts')
+    motions_store = SQLiteCollectionStore(database, 'motions')
+else:
+    session_store = JSONSessionStore(SESSIONS_FOLDER, legacy_file=LEGACY_SESSIONS_FILE)
+    audio_store = JSONCollectionStore(AUDIO_SHORTCUTS_FILE, 'audio_shortcuts')
+    action_store = JSONCollectionStore(ACTION_SHORTCUTS_FILE, 'action_shortcuts')
+    motions_store = JSONCollectionStore(MOTIONS_FILE, 'motions')
+
+persistence_manager = PersistenceManager(PERSISTENCE_INTERVAL)
+change_tracker = ChangeTracker(['sessions', 'audio_shortcuts', 'action_shortcuts', 'motions'])
+search_index = SearchIndex()
 actions_handler = ActionsHandler()
-motions_handler = MotionsHandler(MOTIONS_FILE, ADDITINAL_MOTIONS_FOLDER, actions_handler)
-sessions_handler = SessionsHandler(SESSIONS_FILE, actions_handler, motions_handler)
-audio_shortcuts_handler = AudioShortcutsHandler(AUDIO_SHORTCUTS_FILE, actions_handler)
-action_shortcuts_handler = ActionShortcutsHandler(ACTION_SHORTCUTS_FILE, actions_handler, motions_handler)
+media_handler = MediaHandler(UPLOADS_FOLDER, TRASH_FOLDER)
+motions_handler = MotionsHandler(motions_store, ADDITINAL_MOTIONS_FOLDER, actions_handler, persistence_manager,
+                                 change_tracker)
+sessions_handler = SessionsHandler(session_store, actions_handler, motions_handler, media_handler,
+                                   persistence_manager, change_tracker, search_index, SESSION_WORKING_SET)
+audio_shortcuts_handler = AudioShortcutsHandler(audio_store, actions_handler, media_handler, persistence_manager,
+                                                change_tracker, search_index)
+action_shortcuts_handler = ActionShortcutsHandler(action_store, actions_handler, motions_handler, media_handler,
+                                                  persistence_manager, change_tracker, search_index)
+sessions_handler.start_indexing()
 
 if CLOUDFRONT_SERVER:
     recording_manager = RecordingForwardingManager()
@@ -128,6 +181,7 @@ else:
     recording_manager = RecordingManager()
 pepper_connection_manager = PepperConnectionManager(motions_handler, actions_handler, recording_manager)
 address_forwarder = AddressForwarder(10)
+synthesis_manager = SynthesisManager()
 
 
 # Verbose 422 logging (see https://fastapi.tiangolo.com/tutorial/handling-errors/#use-the-requestvalidationerror-body)
@@ -178,31 +232,72 @@ async def stop_video(conn: str):
     return await pepper_connection_manager.clear_fragment(conn)
 
 
+# Conditional requests: library responses carry the version of their content as the ETag,
+# requests with that ETag in If-None-Match get an empty 304 response until the content changes.
+def versioned_response(request, etag, get_content):
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in [tag[2:] if tag.startswith("W/") else tag for tag in if_none_match]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(jsonable_encoder(get_content()), headers=headers)
+
+
 # Sessions
 
 @app.get("/api/sessions/",
          tags=['Sessions'], summary="Get all sessions.")
-def get_sessions():
-    return sessions_handler.get_sorted_sessions()
+def get_sessions(request: Request):
+    return versioned_response(request, change_tracker.etag('sessions'), sessions_handler.get_sorted_sessions)
+
+
+# Declared before /api/sessions/{session_id}, so "summary" isn't taken for a session ID
+@app.get("/api/sessions/summary",
+         tags=['Sessions'], summary="Get the names, descriptions, item counts and modification times of sessions.",
+         description="Sessions are sorted by name. To get the next page, pass the returned next_cursor as cursor "
+                     "(it's null on the last page). prefix only lists sessions whose name starts with it.")
+def get_session_summaries(request: Request, limit: int = Query(50, ge=1, le=500), cursor: str = None,
+                          prefix: str = ""):
+    return versioned_response(request, change_tracker.etag('sessions'),
+                              lambda: sessions_handler.get_session_summaries(limit, cursor=cursor, prefix=prefix))
 
 
 @app.post("/api/sessions/",
           tags=['Sessions'], summary="Add a session.")
 def post_session(session: Session):
     sessions_handler.add_session(session)
+    queue_missing_synthesis(session.ID, [action for session_item in session.Items for action in session_item.Actions])
     return {"message": "Session saved!"}
 
 
 @app.get("/api/sessions/{session_id}",
          tags=['Sessions'], summary="Get a specific session.")
-def get_session(session_id: UUID = Path(...)):
-    return sessions_handler.get_session(session_id)
+def get_session(request: Request, session_id: UUID = Path(...)):
+    return versioned_response(request, change_tracker.etag('sessions', session_id),
+                              lambda: sessions_handler.get_session(session_id))
 
 
 @app.put("/api/sessions/{session_id}",
          tags=['Sessions'], summary="Update an existing session.")
 def update_session(session: Session, session_id: UUID = Path(...)):
-    return sessions_handler.update_session(session_id, session)
+    response = sessions_handler.update_session(session_id, session)
+    if 'error' not in response:
+        queue_missing_synthesis(session.ID, [action for session_item in session.Items for action in session_item.Actions])
+    return response
+
+
+@app.patch("/api/sessions/{session_id}",
+           tags=['Sessions'], summary="Add, replace, move or delete questions and actions of a session.",
+           description="Operations are applied in order, all of them or none if one fails. Each operation is one of: "
+                       "add (Item at Position, or Action at Position in the question ItemID; the end by default), "
+                       "replace (the question or action ID with Item or Action), "
+                       "move (the question ID to Position, or the action ID to Position in the question ItemID) and "
+                       "delete (the question or action ID).")
+def patch_session(patch: SessionPatch, session_id: UUID = Path(...)):
+    response = sessions_handler.patch_session(session_id, patch.Operations)
+    if 'error' not in response:
+        queue_missing_synthesis(session_id, [action for operation in patch.Operations
+                                             for action in operation.get_actions()])
+    return response
 
 
 # TODO: make all deletions non-destructive (?)
@@ -225,6 +320,20 @@ def get_exported_session(session_id: UUID = Path(...)):
     return compress_session(sessions_handler.get_session(session_id))
 
 
+@app.get("/api/export_session/{session_id}/download",
+         tags=['Sessions'], summary="Download an exported session archive.",
+         description="Unchanged sessions are served from the stored archive, others are streamed as they are archived.")
+def download_exported_session(session_id: UUID = Path(...)):
+    session = sessions_handler.get_session(session_id)
+    if session is None:
+        return {'error': f"Couldn't find session {session_id}!"}
+    filename = session.Name + ".zip"
+    if (file_path := cached_session_archive(session)) is not None:
+        return FileResponse(file_path, media_type="application/zip", filename=filename)
+    return StreamingResponse(stream_session_archive(session), media_type="application/zip",
+                             headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"})
+
+
 @app.delete("/api/instruction/{action_id}",
             tags=['Sessions'], summary="Remove an action from a question (SessionItem).")
 def delete_session_action(action_id: UUID = Path(...)):
@@ -235,8 +344,8 @@ def delete_session_action(action_id: UUID = Path(...)):
 
 @app.get("/api/actions/",
          tags=['Actions'], summary="Get all action shortcuts.")
-def get_action_shortcuts():
-    return action_shortcuts_handler.get_actions()
+def get_action_shortcuts(request: Request):
+    return versioned_response(request, change_tracker.etag('action_shortcuts'), action_shortcuts_handler.get_actions)
 
 
 @app.post("/api/actions/",
@@ -261,19 +370,16 @@ def delete_action_shortcut(action_id: UUID = Path(...)):
 
 @app.get("/api/audio/",
          tags=['Audio'], summary="Get metadata of all quick audio files.")
-def get_audio_shortcuts():
-    return audio_shortcuts_handler.get_audio_metadata()
+def get_audio_shortcuts(request: Request):
+    return versioned_response(request, change_tracker.etag('audio_shortcuts'),
+                              audio_shortcuts_handler.get_audio_metadata)
 
 
 @app.post("/api/audio/",
           tags=['Audio'], summary="Add a new audio shortcut")
 async def post_audio_shortcut(file_content: UploadFile, phrase: str = Form(...), group: str = Form("Default")):
-    phrase_hash = hash_phrase_to_filename(phrase)
-    save_path = os.path.join("data", "uploads", f"{phrase_hash}.wav")
-    if not os.path.isfile(save_path):
-        async with async_open(save_path, "wb") as save_file:
-            while content := await file_content.read(1024):
-                await save_file.write(content)
+    save_path = await save_upload(file_content, "wav", name=hash_phrase_to_filename(phrase))
+    await run_in_threadpool(robot_audio, save_path)
     audio_shortcuts_handler.add_audio(UtteranceItem.parse_obj({"ID": uuid4(),
                                                                "Group": group,
                                                                "Delay": 0,
@@ -296,12 +402,38 @@ def remove_audio_shortcut(audio_id: UUID = Path(...)):
     return {"message": "Audio shortcut removed"}
 
 
+class ShortcutOperations(BaseModel):
+    action_shortcuts: List[ShortcutOperation] = []
+    audio_shortcuts: List[AudioShortcutOperation] = []
+
+
+@app.post("/api/shortcuts/bulk",
+          tags=['Actions', 'Audio'], summary="Create, update and delete action and audio shortcuts at once.",
+          description="Operations are create (Action or Audio, given a new ID), update (the shortcut with the ID of "
+                      "Action or Audio) and delete (the shortcut ID), applied in order. All of them are checked "
+                      "first: if one fails, nothing is changed. Returns the IDs of the created shortcuts.")
+def post_shortcut_operations(operations: ShortcutOperations):
+    # No other change may come between checking the operations and applying them
+    with action_shortcuts_handler.lock, audio_shortcuts_handler.lock:
+        error = action_shortcuts_handler.check_operations(operations.action_shortcuts) or \
+            audio_shortcuts_handler.check_operations(operations.audio_shortcuts)
+        if error:
+            return {'error': error}
+        created = {'action_shortcuts': action_shortcuts_handler.apply_operations(operations.action_shortcuts),
+                   'audio_shortcuts': audio_shortcuts_handler.apply_operations(operations.audio_shortcuts)}
+    # The robot's copy of the audio is made once the shortcuts are unlocked, like for a single audio shortcut
+    for operation in operations.audio_shortcuts:
+        if operation.Audio is not None:
+            robot_audio(operation.Audio.FilePath)
+    return {'message': 'Shortcuts updated!', **created}
+
+
 # Motions
 
 @app.get("/api/motions/",
          tags=['Motions'], summary="Get metadata of all movements.")
-def get_moves():
-    return motions_handler.get_motions()
+def get_moves(request: Request):
+    return versioned_response(request, change_tracker.etag('motions'), motions_handler.get_motions)
 
 
 @app.get("/api/motions/{move_id}",
@@ -323,6 +455,8 @@ class SynthesisRequest(BaseModel):
     phrase: str
     voice: str
     speed: float
+    # Previously synthesized audio is reused unless explicitly invalidated
+    force: bool = False
 
     @validator('speed')
     def speed_validator(cls, spd):
@@ -336,68 +470,272 @@ class SynthesisRequest(BaseModel):
           tags=['Synthesis'], summary="Synthesize speech using the given phrase. Returns the path to the resulting file.")
 def post_synthesize(sr: SynthesisRequest):
     print(sr)
-    return {'message': 'Audio synthesized!', 'filepath': synthesize(sr.phrase, sr.voice, sr.speed, force=True)}
+    try:
+        filepath = synthesize(sr.phrase, sr.voice, sr.speed, force=sr.force)
+    except SynthesisError as e:
+        return {'error': f"Synthesis failed: {e}"}
+    return {'message': 'Audio synthesized!', 'filepath': filepath}
 
 
 @app.post("/api/synthesis/batch",
           tags=['Synthesis'], summary="Synthesize all speech for the given session.")
-def post_synthesize_batch(voice: str, session: Session):
+def post_synthesize_batch(voice: str, session: Session, force: bool = False):
+    utterances = []
     for session_item in session.Items:
         for action in session_item.Actions:
             if action.UtteranceItem and action.UtteranceItem.Phrase:
-                if action.UtteranceItem.Pronunciation and action.UtteranceItem.Pronunciation != action.UtteranceItem.Phrase:
-                    phrase = action.UtteranceItem.Pronunciation
-                else:
-                    phrase = action.UtteranceItem.Phrase
-                    action.UtteranceItem.Pronunciation = ""
-                action.UtteranceItem.FilePath = synthesize(phrase, voice, action.UtteranceItem.Speed, force=True)
+                action.UtteranceItem.pronunciation_cleanup()
+                utterances.append((action.UtteranceItem,
+                                   (action.UtteranceItem.synthesis_phrase(), voice, action.UtteranceItem.Speed)))
+
+    results = synthesize_batch([triple for _, triple in utterances], force=force)
+    for utterance, triple in utterances:
+        if isinstance(results[triple], Exception):
+            return {'error': f"Synthesis failed for '{triple[0]}': {results[triple]}"}
+        utterance.FilePath = results[triple]
     return sessions_handler.update_session(session.ID, session)
 
 
+@app.post("/api/synthesis/jobs",
+          tags=['Synthesis'], summary="Queue synthesis of all speech for the given session. Returns a job ID.",
+          description="The session is saved, then its audio files are attached once all of its speech has been "
+                      "synthesized, see /api/synthesis/jobs/{job_id} for progress.")
+def post_synthesis_job(voice: str, session: Session, force: bool = False):
+    result = sessions_handler.update_session(session.ID, session)
+    if 'error' in result:
+        return result
+    tasks = {action.UtteranceItem.ID: (action.UtteranceItem.synthesis_phrase(), voice, action.UtteranceItem.Speed)
+             for session_item in session.Items for action in session_item.Actions
+             if action.UtteranceItem and action.UtteranceItem.Phrase}
+
+    def on_complete(file_paths):
+        return attach_synthesized_audio(session.ID, tasks, file_paths)
+
+    return {'message': 'Session updated, synthesis queued!',
+            'job_id': synthesis_manager.submit(tasks, on_complete, force=force)}
+
+
+@app.get("/api/synthesis/jobs/{job_id}",
+         tags=['Synthesis'], summary="Get the per-utterance progress of a synthesis job.")
+def get_synthesis_job(job_id: str = Path(...)):
+    return synthesis_manager.get_progress(job_id)
+
+
+def create_image_variants(file_paths):
+    for file_path in file_paths:
+        if media_type(file_path) == "image":
+            image_variants(file_path)
+
+
+# Queue synthesis for utterances of the given actions of a saved session that have no audio yet, using the default voice
+def queue_missing_synthesis(session_id, actions):
+    tasks = {utterance.ID: (utterance.synthesis_phrase(), SPEAKER, utterance.Speed)
+             for utterance in utterances_missing_audio(actions)}
+    if not tasks:
+        return None
+
+    def on_complete(file_paths):
+        return attach_synthesized_audio(session_id, tasks, file_paths)
+
+    return synthesis_manager.submit(tasks, on_complete)
+
+
+# Attach the files of a finished synthesis job to the stored session. Only the audio files are attached, edits made
+# while the job ran are kept. Returns the utterance IDs whose audio wasn't attached (see SynthesisManager.submit).
+def attach_synthesized_audio(session_id, tasks, file_paths):
+    result = sessions_handler.set_utterance_files(session_id, {utterance_id: (tasks[utterance_id][0], file_path)
+                                                               for utterance_id, file_path in file_paths.items()})
+    return result.get('unattached', list(file_paths))
+
+
 # Uploads
 
 @app.post("/api/upload/audio",
           tags=['Uploads'], summary="Upload session audio")
 async def post_audio(file_content: UploadFile):
-    return await hash_and_save_file(file_content, "Audio file")
+    response = await hash_and_save_file(file_content, "Audio file")
+    await run_in_threadpool(robot_audio, response['filepath'])
+    return response
 
 
 @app.post("/api/upload/image",
           tags=["Uploads"], summary="Upload session image")
 async def post_image(file_content: UploadFile):
-    return await hash_and_save_file(file_content, "Image")
+    response = await hash_and_save_file(file_content, "Image")
+    response['thumbnail'] = (await run_in_threadpool(image_variants, response['filepath']))['thumbnail']
+    return response
+
+
+@app.get("/api/thumbnail",
+         tags=['Uploads'], summary="Get a preview of an uploaded image.")
+def get_thumbnail(filepath: str):
+    if not media_handler.is_upload(filepath):
+        return {'error': f"No uploaded file {filepath}"}
+    if media_type(filepath) != "image":
+        return {'error': f"{filepath} isn't an image"}
+    return FileResponse(thumbnail_image(filepath))
 
 
 @app.post("/api/upload/session",
           tags=['Uploads'], summary="Upload a session")
 async def post_session(file_content: UploadFile):
-    temp_file = TemporaryFile()
-    temp_file.write(file_content.file.read())
-    session_zip = ZipFile(temp_file)
-    if 'session.json' not in session_zip.namelist():
+    # Archive reading and extraction are blocking, keep them off the event loop
+    session_zip, session = await run_in_threadpool(read_archive, file_content.file, 'session.json')
+    if session is None:
         return {'error': 'Session file missing from archive!'}
 
-    for filename in list(filter(lambda x: x.startswith('uploads/'), session_zip.namelist())):
-        # Extract the file manually to avoid wonky directory creation via ZipFile.extract()
-        with open(os.path.join('data', 'uploads', os.path.basename(filename)), 'wb') as f1:
-            f1.write(session_zip.read(filename))
-    with session_zip.open('session.json') as sess:
-        session = json.loads(sess.read())
+    if file_content.filename.replace(".zip", "") != session.get('Name'):
+        return {'error': 'Import failed: archive and session name do not match!'}
+    # Validate the session before writing any media
+    try:
+        Session.parse_obj(session)
+    except ValidationError as e:
+        return {'error': f'Import failed: invalid session file ({e})'}
 
-    if file_content.filename.replace(".zip", "") != session['Name']:
-        return {'error': {'Import failed: archive and session name do not match!'}}
+    await run_in_threadpool(create_image_variants, await run_in_threadpool(extract_archive_media, session_zip))
 
     # If an existing session shares the name with the posted session, the client-side check has passed and
     # the existing session must be updated instead.
-    for old_session in sessions_handler.sessions:
-        if session['Name'] == old_session.Name:
-            await sessions_handler.dict_to_session_rename(session)
-            sessions_handler.update_session(old_session.ID, Session.parse_obj(session))
-            return {'message': "Session update dummy msg", 'session_index': sessions_handler.get_session_index(session['ID'])}
+    if (old_session := sessions_handler.get_session_by_name(session['Name'])) is not None:
+        await sessions_handler.dict_to_session_rename(session)
+        sessions_handler.update_session(old_session.ID, Session.parse_obj(session))
+        return {'message': "Session update dummy msg", 'session_index': sessions_handler.get_session_index(session['ID'])}
     await sessions_handler.import_session(session)
     return {'message': 'Session imported!', 'session_index': sessions_handler.get_session_index(session['ID'])}
 
 
+# Library
+
+@app.get("/api/export_library",
+         tags=['Library'], summary="Export sessions, shortcuts and motions as a single archive.",
+         description="Exports the given sessions (all sessions if none are given) along with all audio and action "
+                     "shortcuts and motions. Media shared between them is stored once, the archive is streamed.")
+def get_exported_library(session_ids: List[UUID] = Query(None)):
+    if session_ids:
+        sessions = [session for session in map(sessions_handler.get_session, session_ids) if session is not None]
+    else:
+        sessions = sessions_handler.get_sessions()['sessions']
+    library = {"sessions": sessions,
+               "audio_shortcuts": audio_shortcuts_handler.audio_items,
+               "action_shortcuts": action_shortcuts_handler.actions,
+               "motions": list(motions_handler.motions.values())}
+
+    media_paths = [path for session in sessions for path in session_media_paths(session)]
+    media_paths += [audio_item.FilePath for audio_item in audio_shortcuts_handler.audio_items]
+    media_paths += [path for action in action_shortcuts_handler.actions for path in action.get_media_paths()]
+    media = {path: os.path.join("uploads", os.path.basename(path)) for path in media_paths
+             if path and os.path.isfile(path)}
+
+    filename = f"library-{datetime.now().strftime('%F')}.zip"
+    return StreamingResponse(stream_archive([("library.json", json.dumps(jsonable_encoder(library)))], list(media.items())),
+                             media_type="application/zip",
+                             headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+@app.post("/api/upload/library",
+          tags=['Library'], summary="Import an exported library.",
+          description="Sessions replace existing sessions with the same ID or name, shortcuts and motions "
+                      "that already exist are skipped, as are media files already present.")
+async def post_library(file_content: UploadFile):
+    library_zip, library = await run_in_threadpool(read_archive, file_content.file, 'library.json')
+    if library is None:
+        return {'error': 'Library file missing from archive!'}
+    # Validate everything before writing any media
+    try:
+        sessions = [Session.parse_obj(session) for session in library.get('sessions', [])]
+        audio_items = [UtteranceItem.parse_obj(audio_item) for audio_item in library.get('audio_shortcuts', [])]
+        actions = [MultiAction.parse_obj(action) for action in library.get('action_shortcuts', [])]
+        motions = [MotionItem.parse_obj(motion) for motion in library.get('motions', [])]
+    except ValidationError as e:
+        return {'error': f'Import failed: invalid library file ({e})'}
+
+    await run_in_threadpool(create_image_variants, await run_in_threadpool(extract_archive_media, library_zip))
+    return await run_in_threadpool(import_library, sessions, audio_items, actions, motions)
+
+
+def import_library(sessions, audio_items, actions, motions):
+    for motion in motions:
+        motions_handler.add_motion(motion.Name, group=motion.Group, path=motion.FilePath)
+    motions_handler.save_motions()
+
+    updated = 0
+    for session in sessions:
+        existing = sessions_handler.get_session(session.ID)
+        if existing is None:
+            existing = sessions_handler.get_session_by_name(session.Name)
+        if existing is None:
+            sessions_handler.add_session(session)
+        else:
+            session.ID = existing.ID
+            sessions_handler.update_session(existing.ID, session)
+            updated += 1
+
+    audio_added = 0
+    for audio_item in audio_items:
+        if audio_shortcuts_handler.get_single_audio_metadata(audio_item.ID)['audio_shortcuts'] is None:
+            audio_shortcuts_handler.add_audio(audio_item)
+            audio_added += 1
+
+    actions_added = 0
+    existing_action_ids = {action.ID for action in action_shortcuts_handler.actions}
+    for action in actions:
+        if action.ID not in existing_action_ids:
+            action_shortcuts_handler.import_action(action)
+            actions_added += 1
+
+    return {'message': f"Library imported: {len(sessions) - updated} new and {updated} updated sessions, "
+                       f"{audio_added} audio and {actions_added} action shortcuts."}
+
+
+@app.get("/api/changes",
+         tags=['Library'], summary="Get the sessions, shortcuts and motions added, updated or removed since a version.",
+         description="Pass the epoch and version of the previous response. If the epoch has changed (the server "
+                     "restarted) or since is 0, reset is true and everything is returned as updated.")
+def get_changes(since: int = Query(0, ge=0), epoch: str = None):
+    reset = since == 0 or epoch != change_tracker.epoch
+    version = change_tracker.version
+    getters = {'sessions': (lambda session_id: sessions_handler.get_session(session_id, keep=False),
+                            lambda: list(sessions_handler.summaries.keys())),
+               'audio_shortcuts': (audio_shortcuts_handler.get_audio, lambda: audio_shortcuts_handler.audio_ids.keys()),
+               'action_shortcuts': (action_shortcuts_handler.get_action,
+                                    lambda: [action.ID for action in action_shortcuts_handler.actions]),
+               'motions': (motions_handler.get_motion_by_id, lambda: motions_handler.motion_ids.keys())}
+    response = {'epoch': change_tracker.epoch, 'version': version, 'reset': reset}
+    for collection, (get_item, get_all_ids) in getters.items():
+        changed, removed = (list(get_all_ids()), []) if reset else change_tracker.changes_since(collection, since)
+        items = [get_item(item_id) for item_id in changed]
+        response[collection] = {'updated': [item for item in items if item is not None], 'removed': removed}
+    return response
+
+
+# Search
+
+@app.get("/api/search",
+         tags=['Search'], summary="Search sessions, questions and actions (including shortcuts) by their texts.",
+         description="Phrases, pronunciations, session names and descriptions, action, image and motion names and "
+                     "groups are searched. Every word of q must begin a word of a result, õ, ä, ö, ü, š and ž can "
+                     "also be typed as o, a, o, u, sh and zh. Results matching whole words come first. "
+                     "Sessions are indexed in the background after startup, a search made before that's done waits "
+                     "for it (with SESSION_WORKING_SET, it reads every stored session).")
+def get_search(q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=100)):
+    sessions_handler.index_sessions()
+    return search_index.search(q, limit)
+
+
+# Media
+
+@app.get("/api/media/",
+         tags=['Media'], summary="List uploaded files with their size, type and reference count.")
+def get_media():
+    return media_handler.get_media()
+
+
+@app.post("/api/media/gc",
+          tags=['Media'], summary="Move unreferenced uploads to the trash, empty old trash.")
+def post_media_gc():
+    return media_handler.collect_garbage(MEDIA_GC_GRACE_PERIOD * 3600, MEDIA_TRASH_RETENTION * 86400)
+
+
 # Recording
 
 # @app.get("/api/recording/start",
@@ -436,6 +774,7 @@ def clear_archives():
 @app.get("/api/rebuild",
          tags=['Maintenance'], summary="Rebuild the site via NPM.")
 def get_rebuild():
+    persistence_manager.flush()
     subprocess.Popen('./rebuild.sh', shell=True, preexec_fn=os.setpgrp)
     return {'message': "Started rebuild.sh"}
 
@@ -455,6 +794,7 @@ def get_update_status():
 @app.get("/api/update",
          tags=['Maintenance'], summary="Update the servers")
 def get_update():
+    persistence_manager.flush()
     subprocess.Popen('./update.sh', shell=True, preexec_fn=os.setpgrp)
     return {'message': "Started update.sh"}
 
@@ -462,11 +802,28 @@ def get_update():
 @app.get("/api/shutdown",
          tags=['Maintenance'], summary="Shut the server down.")
 def get_shutdown():
+    persistence_manager.flush()
     os.system("shutdown -P now")
 
 
+@app.get("/api/diagnostics/indexes",
+         tags=['Maintenance'],
+         summary="Check the lookup indexes of sessions, motions and shortcuts and the action registry.")
+def get_index_diagnostics():
+    errors = sessions_handler.check_indexes() + motions_handler.check_indexes() + \
+        audio_shortcuts_handler.check_indexes() + action_shortcuts_handler.check_indexes() + \
+        actions_handler.check_indexes()
+    return {'consistent': not errors, 'errors': errors, 'sessions': sessions_handler.get_statistics(),
+            'action_registry': actions_handler.get_statistics(), 'search_index': search_index.get_statistics()}
+
+
 @app.on_event("shutdown")
 def shutdown_event():
+    # A synthesis job finishing meanwhile saves its session, so the worker stops before the writes are flushed
+    synthesis_manager.stop()
     motions_handler.save_motions()
-    sessions_handler.save_sessions()
+    persistence_manager.stop()
+    if STORAGE_ENGINE == "sqlite":
+        database.close()
+    media_handler.collect_garbage(MEDIA_GC_GRACE_PERIOD * 3600, MEDIA_TRASH_RETENTION * 86400)
     address_forwarder.stop()
@@ -0,0 +1,91 @@
+"""
+Local stand-in for the Neurokõne text-to-speech API, for offline testing and benchmarking of speech synthesis.
+
+To run:
+uvicorn neurokoneStub:app --host 127.0.0.1 --port 8099
+
+Then set TTS_ENDPOINT = "http://127.0.0.1:8099/text-to-speech/v2" in config.py.
+
+Responses are deterministic: the same text, speaker and speed always yield the same WAV file.
+Latency and error injection are set via the environment variables below or at runtime through /settings.
+    NEUROKONE_STUB_LATENCY      Seconds to wait before each response (default 0)
+    NEUROKONE_STUB_ERROR_RATE   Share of requests answered with HTTP 500 (default 0)
+    NEUROKONE_STUB_SEED         Seed for choosing which requests fail (default 0)
+"""
+import io
+import os
+import math
+import wave
+import random
+import struct
+import asyncio
+
+from hashlib import sha256
+from fastapi import FastAPI, Response
+from pydantic import BaseModel
+
+SAMPLE_RATE = 22050
+
+app = FastAPI(title="Neurokõne stand-in")
+settings = {"latency": float(os.environ.get("NEUROKONE_STUB_LATENCY", 0)),
+            "error_rate": float(os.environ.get("NEUROKONE_STUB_ERROR_RATE", 0)),
+            "seed": int(os.environ.get("NEUROKONE_STUB_SEED", 0))}
+error_random = random.Random(settings["seed"])
+counters = {"requests": 0, "errors": 0}
+
+
+class SynthesisRequest(BaseModel):
+    text: str
+    speaker: str
+    speed: float = 1.0
+
+
+class StubSettings(BaseModel):
+    latency: float = None
+    error_rate: float = None
+    seed: int = None
+
+
+# A sine tone, its pitch derived from the request and its length from the amount of text
+def generate_wav(text, speaker, speed):
+    digest = sha256(f"{text}{speaker}{speed}".encode()).digest()
+    frequency = 200 + int.from_bytes(digest[:2], "big") % 400
+    duration = max(0.5, 0.08 * len(text) / speed)
+    frames = b"".join(struct.pack("<h", int(12000 * math.sin(2 * math.pi * frequency * n / SAMPLE_RATE)))
+                      for n in range(int(duration * SAMPLE_RATE)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(frames)
+    return buffer.getvalue()
+
+
+@app.post("/text-to-speech/v2")
+async def post_synthesis(request: SynthesisRequest):
+    counters["requests"] += 1
+    if settings["latency"]:
+        await asyncio.sleep(settings["latency"])
+    if error_random.random() < settings["error_rate"]:
+        counters["errors"] += 1
+        return Response(status_code=500, content="Injected error")
+    return Response(content=generate_wav(request.text, request.speaker, request.speed), media_type="audio/wav")
+
+
+@app.get("/settings")
+def get_settings():
+    return {**settings, **counters}
+
+
+@app.post("/settings")
+def post_settings(new_settings: StubSettings):
+    global error_random
+    for key, value in new_settings.dict().items():
+        if value is not None:
+            settings[key] = value
+    if new_settings.seed is not None:
+        error_random = random.Random(settings["seed"])
+    counters["requests"] = 0
+    counters["errors"] = 0
+    return get_settings()
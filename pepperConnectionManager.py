@@ -6,6 +6,7 @@ from uuid import UUID
 from anyio import Event
 from random import randint
 from fastapi import WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 
 
 class LockManager:
@@ -175,6 +176,9 @@ class PepperConnectionManager:
         lock_manager = self.active_connections[connection_id]["lock_manager"]
 
         action = self.actions_master.get_action(action_id)
+        if action is None:
+            # Sessions outside the working set don't have their actions registered, theirs is read from storage
+            action = await run_in_threadpool(self.actions_master.load_action, action_id)
         if action is None:
             return {action_id: "action_error", 'message': f"Faulty action ID: {action_id}"}
 
@@ -273,7 +277,8 @@ class PepperConnectionManager:
 
         else:
             # Send the command to Pepper
-            await connection.send_text(json.dumps(action.get_command_payload()))
+            # Payloads read media files and may create their variants, that's kept off the event loop
+            await connection.send_text(json.dumps(await run_in_threadpool(action.get_command_payload)))
 
         # Save command start time (relevant for releasing locks on user override)
         lock_manager.item_locks[action_type]['start_time'] = time.time()
@@ -345,7 +350,7 @@ async def send_subcommand(lock_manager, connection, motions_handler, actions_han
     lock_manager.active_commands[action.ID]['event'] = task_finished
 
     # Send the command to Pepper
-    await connection.send_text(json.dumps(action.get_command_payload()))
+    await connection.send_text(json.dumps(await run_in_threadpool(action.get_command_payload)))
 
     # Save command start time (relevant for releasing erroneous locks)
     lock_manager.item_locks[action_type]['start_time'] = time.time()
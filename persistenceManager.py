@@ -0,0 +1,62 @@
+import logging
+
+from threading import Thread, Lock, Event
+
+
+class PersistenceWorker(Thread):
+    def __init__(self, caller, interval):
+        super().__init__(daemon=True)
+        self.caller = caller
+        self.interval = interval
+
+    def run(self):
+        while self.caller.flag:
+            self.caller.wakeup.wait(self.interval)
+            self.caller.flush()
+
+
+# Write-behind persistence for the data handlers.
+# Handlers mark their state dirty with a write function instead of writing on every change; the worker calls each
+# pending write function at most once per interval (and on stop), so a burst of changes results in a single write.
+# Write functions serialize the state as it is when they are called, not as it was when it was marked dirty.
+class PersistenceManager:
+    def __init__(self, interval):
+        self.dirty = {}
+        # Guards the dirty writes
+        self.lock = Lock()
+        # Ensures writes don't run concurrently (e.g. a durable write during a periodic flush)
+        self.write_lock = Lock()
+        self.wakeup = Event()
+        self.flag = True
+        self.worker = PersistenceWorker(self, interval)
+        self.worker.start()
+
+    # Schedule write() under key, replacing any write pending under the same key.
+    # Writes are performed in the order they were (last) marked dirty in.
+    # durable: write everything pending right away, returning once it's on disk
+    def mark_dirty(self, key, write, durable=False):
+        with self.lock:
+            self.dirty.pop(key, None)
+            self.dirty[key] = write
+        if durable:
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                pending = self.dirty
+                self.dirty = {}
+            for key, write in pending.items():
+                try:
+                    write()
+                except Exception as e:
+                    # Keep the write pending unless the state has been marked dirty again meanwhile
+                    logging.error(f"Failed to save {key}, retrying on the next flush: {e!r}")
+                    with self.lock:
+                        self.dirty.setdefault(key, write)
+
+    def stop(self):
+        self.flag = False
+        self.wakeup.set()
+        self.worker.join()
+        self.flush()
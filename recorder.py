@@ -1,8 +1,6 @@
 import json
 import wave
 import asyncio
-import pyaudio
-import websockets
 
 from os import path
 from datetime import datetime
@@ -17,7 +15,7 @@ class RecordingWorker(Thread):
         self.record = False
 
         self.chunk = 1536
-        self.sample_format = pyaudio.paInt16
+        self.sample_format = caller.pyaudio_module.paInt16
         self.channels = 1
         self.sample_rate = 16000
         self.filename = filename
@@ -25,6 +23,7 @@ class RecordingWorker(Thread):
 
     # Starlette's websockets don't enable creating connections, so plain websockets is used instead (requires async).
     async def stream_audio(self, pyaudio_stream):
+        import websockets
         async with websockets.connect("wss://" + CLOUDFRONT_SERVER + AUDIO_ENDPOINT) as websocket:
             await websocket.send(json.dumps({"ch": self.channels,
                                              "sw": self.caller.pyaudio.get_sample_size(self.sample_format),
@@ -71,7 +70,8 @@ class Recorder:
         self.stream = stream
         self.worker = None
         self.flag = False
-        self.pyaudio = pyaudio.PyAudio()
+        self.pyaudio_module = None
+        self.pyaudio = None
 
     def record(self, filename=None):
         if self.worker is not None:
@@ -79,6 +79,12 @@ class Recorder:
             return
         self.flag = True
 
+        # PyAudio (and the ALSA device scan it does) is loaded on the first recording, not on startup
+        if self.pyaudio is None:
+            import pyaudio
+            self.pyaudio_module = pyaudio
+            self.pyaudio = pyaudio.PyAudio()
+
         self.worker = RecordingWorker(filename, self)
         self.worker.start()
         print("Recording started.")
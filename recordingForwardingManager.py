@@ -1,5 +1,3 @@
-import requests
-
 from config import CLOUDFRONT_SERVER, START_RECORD_ENDPOINT, ACTION_ENDPOINT
 from recorder import Recorder
 
@@ -23,6 +21,7 @@ class RecordingForwardingManager:
         self.recorder.stop_recording()
 
     def record_command(self, command):
+        import requests
         action_type, action = command.get_command_description()
         r = requests.get("https://" + CLOUDFRONT_SERVER + ACTION_ENDPOINT, params={"action_type": action_type,
                                                                                    "action": action,
@@ -30,6 +29,7 @@ class RecordingForwardingManager:
         print(r.json())
 
     def start_recording(self, connection_id):
+        import requests
         self.session_name = requests.get("https://" + CLOUDFRONT_SERVER + START_RECORD_ENDPOINT).json()['session_name']
         self.recording_connection = connection_id
         self.recording_paused = False
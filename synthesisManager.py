@@ -0,0 +1,115 @@
+from queue import Queue
+from uuid import uuid4
+from threading import Thread, Lock
+
+from data_handlers.file_operations import synthesize_batch
+
+
+class SynthesisWorker(Thread):
+    def __init__(self, caller):
+        super().__init__(daemon=True)
+        self.caller = caller
+
+    def run(self):
+        while (job_id := self.caller.queue.get()) is not None:
+            if self.caller.stopping:
+                self.caller.cancel_job(job_id)
+            else:
+                self.caller.run_job(job_id)
+
+
+# Queue of batch synthesis jobs processed in the background.
+# A job is a dict of {key: (phrase, voice, speed)}, keys being utterance IDs reported back in the progress.
+class SynthesisManager:
+    def __init__(self, finished_jobs_kept=100):
+        self.jobs = {}
+        self.callbacks = {}
+        self.finished_jobs_kept = finished_jobs_kept
+        self.lock = Lock()
+        self.queue = Queue()
+        # Set by stop(), jobs still queued are then cancelled rather than run
+        self.stopping = False
+        self.worker = SynthesisWorker(self)
+        self.worker.start()
+
+    # on_complete({key: filepath}) is called once with the successfully synthesized files when the job finishes,
+    # returning the keys whose file couldn't be used (reported as errors)
+    def submit(self, tasks, on_complete, force=False):
+        job_id = str(uuid4())
+        with self.lock:
+            self.jobs[job_id] = {"job_id": job_id,
+                                 "status": "queued",
+                                 "tasks": dict(tasks),
+                                 "force": force,
+                                 "items": {str(key): "pending" for key in tasks},
+                                 "errors": {}}
+            self.callbacks[job_id] = on_complete
+        self.queue.put(job_id)
+        return job_id
+
+    def run_job(self, job_id):
+        job = self.jobs[job_id]
+        job["status"] = "running"
+        keys_by_triple = {}
+        for key, triple in job["tasks"].items():
+            keys_by_triple.setdefault(triple, []).append(key)
+
+        def on_result(triple, result):
+            with self.lock:
+                for key in keys_by_triple[triple]:
+                    if isinstance(result, Exception):
+                        job["items"][str(key)] = "error"
+                        job["errors"][str(key)] = str(result)
+                    else:
+                        job["items"][str(key)] = "done"
+
+        results = synthesize_batch(list(keys_by_triple), force=job["force"], on_result=on_result)
+        file_paths = {key: results[triple] for key, triple in job["tasks"].items()
+                      if not isinstance(results[triple], Exception)}
+        try:
+            unused = self.callbacks.pop(job_id)(file_paths)
+        except Exception as e:
+            job["errors"]["job"] = str(e)
+            unused = file_paths
+        with self.lock:
+            for key in unused:
+                job["items"][str(key)] = "error"
+                job["errors"][str(key)] = "The audio wasn't attached, the utterance was changed or removed meanwhile"
+        job["status"] = "finished"
+        self._prune_jobs()
+
+    def cancel_job(self, job_id):
+        job = self.jobs[job_id]
+        self.callbacks.pop(job_id, None)
+        with self.lock:
+            for key in job["items"]:
+                job["items"][key] = "error"
+            job["errors"]["job"] = "Cancelled, the server was shut down"
+        job["status"] = "finished"
+
+    def _prune_jobs(self):
+        with self.lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job["status"] == "finished"]
+            for job_id in finished[:-self.finished_jobs_kept]:
+                self.jobs.pop(job_id)
+
+    def get_progress(self, job_id):
+        if job_id not in self.jobs:
+            return {"error": f"No synthesis job with ID {job_id}"}
+        job = self.jobs[job_id]
+        with self.lock:
+            items = dict(job["items"])
+            errors = dict(job["errors"])
+        return {"job_id": job_id,
+                "status": job["status"],
+                "total": len(items),
+                "completed": sum(status == "done" for status in items.values()),
+                "failed": sum(status == "error" for status in items.values()),
+                "items": items,
+                "errors": errors}
+
+    # Finish the running job and cancel the queued ones, returns once the worker has stopped
+    def stop(self):
+        self.stopping = True
+        self.queue.put(None)
+        self.worker.join()
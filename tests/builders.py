@@ -0,0 +1,47 @@
+import os
+
+from persistenceManager import PersistenceManager
+from data_handlers.action import ActionsHandler, ActionShortcutsHandler, MultiAction
+from data_handlers.audio import AudioShortcutsHandler
+from data_handlers.changes import ChangeTracker
+from data_handlers.media import MediaHandler
+from data_handlers.motion import MotionsHandler
+from data_handlers.search import SearchIndex
+from data_handlers.session import SessionsHandler, Session
+from data_handlers.storage import JSONSessionStore, JSONCollectionStore
+
+
+def multiaction(phrase, motion=""):
+    return MultiAction.parse_obj({"UtteranceItem": {"Phrase": phrase, "Delay": 0, "FilePath": ""},
+                                  "MotionItem": {"Name": motion, "FilePath": "", "Delay": 0}})
+
+
+def session(name, phrases):
+    return Session.parse_obj({"Name": name, "Description": "",
+                              "Items": [{"Actions": [multiaction(phrase).dict()]} for phrase in phrases]})
+
+
+# The handlers of main.py on JSON storage in folder, as a dict by name
+def build_handlers(folder, working_set_size):
+    for name in ["sessions", "motions", "uploads", "trash"]:
+        os.makedirs(os.path.join(folder, name), exist_ok=True)
+    persistence = PersistenceManager(60)
+    changes = ChangeTracker(['sessions', 'audio_shortcuts', 'action_shortcuts', 'motions'])
+    search = SearchIndex()
+    actions = ActionsHandler()
+    media = MediaHandler(os.path.join(folder, "uploads"), os.path.join(folder, "trash"))
+    motions = MotionsHandler(JSONCollectionStore(os.path.join(folder, "motions.json"), 'motions'),
+                             os.path.join(folder, "motions"), actions, persistence, changes)
+    sessions = SessionsHandler(JSONSessionStore(os.path.join(folder, "sessions")), actions, motions, media,
+                               persistence, changes, search, working_set_size)
+    audio = AudioShortcutsHandler(JSONCollectionStore(os.path.join(folder, "audio.json"), 'audio_shortcuts'),
+                                  actions, media, persistence, changes, search)
+    shortcuts = ActionShortcutsHandler(JSONCollectionStore(os.path.join(folder, "shortcuts.json"), 'action_shortcuts'),
+                                       actions, motions, media, persistence, changes, search)
+    return {"persistence": persistence, "actions": actions, "motions": motions, "sessions": sessions,
+            "audio": audio, "shortcuts": shortcuts, "media": media, "search": search}
+
+
+def index_errors(handlers):
+    return [error for name in ["sessions", "motions", "audio", "shortcuts", "actions"]
+            for error in handlers[name].check_indexes()]
@@ -0,0 +1,11 @@
+import pytest
+
+from builders import build_handlers
+
+
+# The handlers with every session in memory and with a working set of one session
+@pytest.fixture(params=[0, 1], ids=["all_in_memory", "working_set"])
+def handlers(request, tmp_path):
+    handlers = build_handlers(str(tmp_path), request.param)
+    yield handlers
+    handlers["persistence"].stop()
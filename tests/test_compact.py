@@ -0,0 +1,52 @@
+import sys
+from uuid import UUID
+
+from builders import multiaction, session
+from data_handlers.compact import Record, compact, expand, replace
+from data_handlers.session import Session
+
+
+def stored():
+    model = session("Esimene", ["tere", "head aega"])
+    model.ID = UUID(int=1)
+    for number, session_item in enumerate(model.Items):
+        session_item.ID = UUID(int=10 + number)
+        session_item.Actions[0].ID = UUID(int=20 + number)
+        # Equal strings that aren't the same object
+        session_item.Actions[0].MotionItem.Name = "".join(["wa", "ve"])
+    return model
+
+
+def test_round_trip():
+    model = stored()
+    record = compact(model)
+    assert isinstance(record, Record) and not hasattr(record, "__dict__")
+    assert isinstance(record.Items, tuple) and isinstance(record.Items[0].Actions[0], Record)
+    expanded = expand(record)
+    assert type(expanded) is Session
+    assert expanded == model
+    assert expanded.dict() == model.dict()
+    assert Session.parse_obj(expanded.dict()) == model
+
+
+def test_strings_are_interned():
+    first, second = compact(stored()).Items
+    assert first.Actions[0].MotionItem.Name is second.Actions[0].MotionItem.Name is sys.intern("wave")
+
+
+def test_share_uuid():
+    shared = UUID(int=20)
+    record = compact(stored(), lambda value: shared if value == shared else value)
+    assert record.Items[0].Actions[0].ID is shared
+
+
+def test_replace_shares_the_other_fields():
+    record = compact(stored())
+    action = compact(multiaction("uus"))
+    item = replace(record.Items[0], Actions=(action,))
+    changed = replace(record, Items=(item, record.Items[1]))
+    assert changed.Items[1] is record.Items[1]
+    assert changed.Name is record.Name
+    assert [item.Actions[0].UtteranceItem.Phrase for item in expand(changed).Items] == ["uus", "head aega"]
+    # The original record is unchanged
+    assert expand(record) == stored()
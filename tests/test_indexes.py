@@ -0,0 +1,78 @@
+from uuid import uuid4
+
+from builders import build_handlers, index_errors, multiaction, session
+from data_handlers.action import UtteranceItem
+from data_handlers.session import SessionItem, SessionOperation
+
+
+def test_indexes_after_changes(handlers, tmp_path):
+    sessions = handlers["sessions"]
+
+    first = session("Esimene", ["tere", "kuidas läheb"])
+    second = session("Teine", ["head aega"])
+    sessions.add_session(first)
+    sessions.add_session(second)
+    handlers["motions"].add_motions({"moves": ["wave", "nod"]})
+    assert index_errors(handlers) == []
+
+    # Patch: add a question and an action, replace an action, move and delete questions
+    item = SessionItem(Actions=[multiaction("uus", motion="wave")])
+    added_action = multiaction("lisatud")
+    replaced_id = first.Items[1].Actions[0].ID
+    result = sessions.patch_session(first.ID, [
+        SessionOperation(Op='add', Item=item, Position=0),
+        SessionOperation(Op='add', Action=added_action, ItemID=first.Items[0].ID),
+        SessionOperation(Op='replace', ID=replaced_id, Action=multiaction("asendatud")),
+        SessionOperation(Op='move', ID=first.Items[1].ID, Position=0),
+        SessionOperation(Op='delete', ID=first.Items[0].Actions[0].ID)])
+    assert 'error' not in result
+    assert index_errors(handlers) == []
+
+    # An action ID that's already in the session is rejected, leaving the session as it was
+    duplicate = multiaction("kordus")
+    duplicate.ID = added_action.ID
+    result = sessions.patch_session(first.ID, [SessionOperation(Op='add', Item=SessionItem(Actions=[duplicate]))])
+    assert 'error' in result
+    result = sessions.patch_session(first.ID, [SessionOperation(Op='replace', ID=item.ID,
+                                                                Item=SessionItem(Actions=[duplicate]))])
+    assert 'error' in result
+    assert index_errors(handlers) == []
+
+    # Update (renaming it and giving it a new ID), remove an action, then a session
+    renamed = sessions.get_session(first.ID)
+    renamed.Name = "Ümbernimetatud"
+    renamed.ID = uuid4()
+    assert 'error' not in sessions.update_session(first.ID, renamed)
+    assert sessions.get_session(first.ID) is None
+    assert [summary['Name'] for summary in sessions.get_session_summaries(10)['sessions']] == \
+        ["Teine", "Ümbernimetatud"]
+    assert 'error' not in sessions.remove_action(renamed.Items[0].Actions[0].ID)
+    assert index_errors(handlers) == []
+    sessions.remove_session(second.ID)
+    assert index_errors(handlers) == []
+
+    # Shortcuts: add, update and remove
+    shortcuts = handlers["shortcuts"]
+    shortcut = multiaction("otsetee", motion="nod")
+    shortcuts.add_action(shortcut)
+    other = multiaction("teine otsetee")
+    shortcuts.add_action(other)
+    updated = multiaction("muudetud otsetee")
+    updated.ID = shortcut.ID
+    assert 'error' not in shortcuts.update_action(updated)
+    assert 'error' not in shortcuts.remove_action(other.ID)
+    audio = UtteranceItem(ID=uuid4(), Phrase="heli", Delay=0, FilePath=str(tmp_path / "uploads" / "heli.wav"))
+    handlers["audio"].add_audio(audio)
+    handlers["audio"].add_audio(UtteranceItem(ID=uuid4(), Phrase="teine heli", Delay=0, FilePath=""))
+    handlers["audio"].remove_audio(audio.ID)
+    assert index_errors(handlers) == []
+
+    # Everything is read back as it was
+    handlers["persistence"].flush()
+    restarted = build_handlers(str(tmp_path), sessions.working_set_size)
+    try:
+        assert restarted["sessions"].get_session(renamed.ID) == sessions.get_session(renamed.ID)
+        assert restarted["actions"].load_action(renamed.Items[1].Actions[0].ID) is not None
+        assert index_errors(restarted) == []
+    finally:
+        restarted["persistence"].stop()
@@ -0,0 +1,70 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from data_handlers.media_files import MediaFiles, parse_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 10)),
+    ("bytes=90-", (90, 100)),
+    ("bytes=90-200", (90, 100)),
+    ("bytes=-10", (90, 100)),
+    ("bytes=-200", (0, 100)),
+    ("bytes=100-", (100, 100)),
+    ("bytes=9-5", (100, 100)),
+    (None, None),
+    ("bytes=-", None),
+    ("bytes=a-b", None),
+    ("bytes=0-1,5-6", None),
+    ("items=0-9", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / "speech.wav").write_bytes(bytes(range(100)))
+    (tmp_path / "image.png").write_bytes(b"png")
+    app = FastAPI()
+    app.mount("/uploads", MediaFiles(directory=str(tmp_path)), name="uploads")
+    return TestClient(app)
+
+
+def test_full_response(client):
+    response = client.get("/uploads/speech.wav")
+    assert response.status_code == 200
+    assert response.content == bytes(range(100))
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["cache-control"] == "public, no-cache"
+    assert "immutable" in client.get("/uploads/image.png").headers["cache-control"]
+
+
+def test_ranges(client):
+    response = client.get("/uploads/speech.wav", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == bytes(range(10, 20))
+    assert response.headers["content-range"] == "bytes 10-19/100"
+
+    response = client.get("/uploads/speech.wav", headers={"Range": "bytes=100-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */100"
+    assert response.content == b""
+
+
+def test_if_range(client):
+    etag = client.get("/uploads/speech.wav").headers["etag"]
+    response = client.get("/uploads/speech.wav", headers={"Range": "bytes=10-19", "If-Range": etag})
+    assert response.status_code == 206
+    # The client's copy is out of date, it gets the whole file
+    response = client.get("/uploads/speech.wav", headers={"Range": "bytes=10-19", "If-Range": '"old"'})
+    assert response.status_code == 200
+    assert len(response.content) == 100
+
+
+def test_not_modified(client):
+    etag = client.get("/uploads/speech.wav").headers["etag"]
+    assert client.get("/uploads/speech.wav", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/uploads/speech.wav", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    assert client.get("/uploads/speech.wav", headers={"If-None-Match": '"old"'}).status_code == 200
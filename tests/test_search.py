@@ -0,0 +1,58 @@
+import unicodedata
+
+import pytest
+
+from data_handlers.search import SearchIndex, tokenize
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    index.set_documents("session", [
+        ("actions", {"ID": "a1"}, ["Kas sa tahad õuna?"]),
+        ("actions", {"ID": "a2"}, ["Punane pall on laual"]),
+        ("actions", {"ID": "a3"}, ["Palun anna mulle punane pall"]),
+        ("items", {"ID": "i1"}, ["Jäätis ja šokolaad"]),
+    ])
+    return index
+
+
+def ids(hits, group="actions"):
+    return [hit["ID"] for hit in hits[group]]
+
+
+def test_tokenize_normalises():
+    assert tokenize("Jäätis, JÄÄTIS!") == ["jäätis", "jäätis"]
+    assert tokenize(unicodedata.normalize("NFD", "jäätis")) == ["jäätis"]
+    assert tokenize(None) == []
+
+
+def test_prefixes_match(index):
+    assert ids(index.search("pal", 10)) == ["a2", "a3"]
+    assert ids(index.search("punane pal", 10)) == ["a2", "a3"]
+    assert ids(index.search("punane kass", 10)) == []
+    assert index.search("", 10) == {"sessions": [], "items": [], "actions": []}
+
+
+def test_letters_are_folded(index):
+    assert ids(index.search("ouna", 10)) == ["a1"]
+    assert ids(index.search("jaatis shokolaad", 10), "items") == ["i1"]
+    # A query with the letters only matches words with them
+    assert ids(index.search("õuna", 10)) == ["a1"]
+    assert ids(index.search("öuna", 10)) == []
+
+
+def test_whole_words_first_ties_by_id(index):
+    # "pall" is a whole word in both, "palun" only starts with "pal"
+    assert ids(index.search("pall", 10)) == ["a2", "a3"]
+    index.set_documents("other", [("actions", {"ID": "a0"}, ["Pallike"])])
+    assert ids(index.search("pall", 10)) == ["a2", "a3", "a0"]
+    assert ids(index.search("pall", 2)) == ["a2", "a3"]
+
+
+def test_changes(index):
+    index.change_documents("session", [("actions", {"ID": "a2"}, ["Sinine kuubik"])], removed={"a3"})
+    assert ids(index.search("pal", 10)) == []
+    assert ids(index.search("kuubik", 10)) == ["a2"]
+    index.release("session")
+    assert index.get_statistics() == {"documents": 0, "terms": 0}
@@ -0,0 +1,82 @@
+import pytest
+
+from builders import index_errors, multiaction, session
+from data_handlers.session import SessionItem, SessionOperation
+
+
+@pytest.fixture
+def stored(handlers):
+    stored = session("Esimene", ["tere", "kuidas läheb"])
+    handlers["sessions"].add_session(stored)
+    return stored
+
+
+def phrases(handlers, session_id):
+    return [[action.UtteranceItem.Phrase for action in session_item.Actions]
+            for session_item in handlers["sessions"].get_session(session_id).Items]
+
+
+def primary_actions(handlers, session_id):
+    return [[action.PrimaryAction for action in session_item.Actions]
+            for session_item in handlers["sessions"].get_session(session_id).Items]
+
+
+def test_operations(handlers, stored):
+    first, second = stored.Items
+    result = handlers["sessions"].patch_session(stored.ID, [
+        SessionOperation(Op='add', Action=multiaction("lisatud"), ItemID=first.ID, Position=0),
+        SessionOperation(Op='add', Item=SessionItem(Actions=[multiaction("uus")])),
+        SessionOperation(Op='replace', ID=second.Actions[0].ID, Action=multiaction("asendatud")),
+        SessionOperation(Op='move', ID=second.ID, Position=0),
+        SessionOperation(Op='move', ID=first.Actions[0].ID, ItemID=second.ID)])
+    assert result == {'message': 'Session updated!'}
+    assert phrases(handlers, stored.ID) == [["asendatud", "tere"], ["lisatud"], ["uus"]]
+    assert primary_actions(handlers, stored.ID) == [[True, False], [True], [True]]
+    assert index_errors(handlers) == []
+
+
+def test_moving_the_first_action_moves_the_primary_action(handlers, stored):
+    first = stored.Items[0]
+    handlers["sessions"].patch_session(stored.ID, [
+        SessionOperation(Op='add', Action=multiaction("teine"), ItemID=first.ID)])
+    handlers["sessions"].patch_session(stored.ID, [SessionOperation(Op='move', ID=first.Actions[0].ID, Position=1)])
+    assert phrases(handlers, stored.ID)[0] == ["teine", "tere"]
+    assert primary_actions(handlers, stored.ID)[0] == [True, False]
+
+
+@pytest.mark.parametrize("make_operation", [
+    lambda first: SessionOperation(Op='add', Item=SessionItem(Actions=[multiaction("uus")]), Position=3),
+    lambda first: SessionOperation(Op='move', ID=first.ID, Position=2),
+    lambda first: SessionOperation(Op='add', Action=multiaction("uus"), ItemID=first.ID, Position=2),
+    lambda first: SessionOperation(Op='move', ID=first.Actions[0].ID, Position=1),
+], ids=["add_item", "move_item", "add_action", "move_action"])
+def test_positions_out_of_range_are_rejected(handlers, stored, make_operation):
+    operation = make_operation(stored.Items[0])
+    result = handlers["sessions"].patch_session(stored.ID, [operation])
+    assert 'out of range' in result['error']
+    assert phrases(handlers, stored.ID) == [["tere"], ["kuidas läheb"]]
+
+
+def test_a_failing_operation_rejects_the_patch(handlers, stored):
+    result = handlers["sessions"].patch_session(stored.ID, [
+        SessionOperation(Op='delete', ID=stored.Items[0].ID),
+        SessionOperation(Op='delete', ID=stored.Items[0].ID)])
+    assert result['error'].startswith("Operation 1:")
+    assert phrases(handlers, stored.ID) == [["tere"], ["kuidas läheb"]]
+
+
+def test_action_ids_of_other_owners_are_rejected(handlers, stored):
+    other = session("Teine", ["head aega"])
+    handlers["sessions"].add_session(other)
+    shortcut = multiaction("otsetee")
+    handlers["shortcuts"].add_action(shortcut)
+    # With a working set of one session, the other session has left it
+    handlers["sessions"].get_session(stored.ID)
+
+    for action_id in [stored.Items[0].Actions[0].ID, other.Items[0].Actions[0].ID, shortcut.ID]:
+        duplicate = multiaction("kordus")
+        duplicate.ID = action_id
+        result = handlers["sessions"].patch_session(stored.ID, [
+            SessionOperation(Op='add', Action=duplicate, ItemID=stored.Items[1].ID)])
+        assert 'error' in result
+    assert index_errors(handlers) == []
@@ -0,0 +1,58 @@
+import json
+from base64 import urlsafe_b64encode
+
+import pytest
+
+from builders import session
+
+
+@pytest.fixture
+def sessions(handlers):
+    for name in ["Banaan", "Apelsin", "Arbuus", "Apelsin", "Ploom"]:
+        handlers["sessions"].add_session(session(name, ["tere"]))
+    return handlers["sessions"]
+
+
+def pages(sessions, limit, prefix=""):
+    names = []
+    page = sessions.get_session_summaries(limit, prefix=prefix)
+    totals = {page["total"]}
+    names.append([summary["Name"] for summary in page["sessions"]])
+    while page["next_cursor"] is not None:
+        page = sessions.get_session_summaries(limit, page["next_cursor"], prefix)
+        totals.add(page["total"])
+        names.append([summary["Name"] for summary in page["sessions"]])
+    return names, totals
+
+
+def test_pages(sessions):
+    assert pages(sessions, 2) == ([["Apelsin", "Apelsin"], ["Arbuus", "Banaan"], ["Ploom"]], {5})
+    assert pages(sessions, 5) == ([["Apelsin", "Apelsin", "Arbuus", "Banaan", "Ploom"]], {5})
+    assert pages(sessions, 2, prefix="A") == ([["Apelsin", "Apelsin"], ["Arbuus"]], {3})
+    assert pages(sessions, 2, prefix="Ap") == ([["Apelsin", "Apelsin"]], {2})
+    assert pages(sessions, 2, prefix="K") == ([[]], {0})
+
+
+def test_summary_fields(sessions):
+    summary = sessions.get_session_summaries(1)["sessions"][0]
+    assert set(summary) == {"ID", "Name", "Description", "ItemCount", "Modified"}
+    assert summary["ItemCount"] == 1
+
+
+def test_changes_between_pages(sessions):
+    page = sessions.get_session_summaries(2)
+    sessions.add_session(session("Aaloe", ["tere"]))
+    # The next page continues after the last session of the previous one
+    assert [summary["Name"] for summary in sessions.get_session_summaries(2, page["next_cursor"])["sessions"]] == \
+        ["Arbuus", "Banaan"]
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    urlsafe_b64encode(b"not json").decode(),
+    urlsafe_b64encode(json.dumps({"Name": "Apelsin"}).encode()).decode(),
+    urlsafe_b64encode(json.dumps(["Apelsin"]).encode()).decode(),
+    urlsafe_b64encode(json.dumps(["Apelsin", 1]).encode()).decode(),
+])
+def test_invalid_cursors(sessions, cursor):
+    assert sessions.get_session_summaries(2, cursor) == {'error': 'Invalid cursor!'}
@@ -0,0 +1,83 @@
+from uuid import uuid4
+
+import pytest
+
+from builders import index_errors, multiaction
+from data_handlers.action import ShortcutOperation, UtteranceItem
+from data_handlers.audio import AudioShortcutOperation
+
+
+@pytest.fixture
+def shortcuts(handlers):
+    for phrase in ["üks", "kaks"]:
+        handlers["shortcuts"].add_action(multiaction(phrase))
+    return handlers["shortcuts"]
+
+
+@pytest.fixture
+def upload(tmp_path):
+    path = tmp_path / "uploads" / "heli.wav"
+    path.write_bytes(b"RIFF")
+    return str(path)
+
+
+def phrases(shortcuts):
+    return [action.UtteranceItem.Phrase for action in shortcuts.get_actions()["action_shortcuts"]]
+
+
+# Check and apply the operations under the lock, as the bulk endpoint does
+def run(handler, operations):
+    with handler.lock:
+        if (error := handler.check_operations(operations)) is not None:
+            return error
+        return handler.apply_operations(operations)
+
+
+def test_action_operations(handlers, shortcuts):
+    first, second = shortcuts.get_actions()["action_shortcuts"]
+    updated = multiaction("kaks muudetud")
+    updated.ID = second.ID
+    created = run(shortcuts, [ShortcutOperation(Op='create', Action=multiaction("kolm")),
+                              ShortcutOperation(Op='update', Action=updated),
+                              ShortcutOperation(Op='delete', ID=first.ID)])
+    assert len(created) == 1
+    assert phrases(shortcuts) == ["kaks muudetud", "kolm"]
+    assert shortcuts.get_action(created[0]) is not None
+    assert handlers["actions"].get_action(first.ID) is None
+    assert index_errors(handlers) == []
+
+
+@pytest.mark.parametrize("make_operations", [
+    lambda first: [ShortcutOperation(Op='delete', ID=first.ID), ShortcutOperation(Op='delete', ID=first.ID)],
+    lambda first: [ShortcutOperation(Op='create', Action=multiaction("kolm")),
+                   ShortcutOperation(Op='delete', ID=uuid4())],
+    lambda first: [ShortcutOperation(Op='delete', ID=first.ID), ShortcutOperation(Op='update', Action=first)],
+    lambda first: [ShortcutOperation(Op='create')],
+], ids=["deleted_twice", "unknown_id", "update_after_delete", "no_action"])
+def test_failing_action_operations_change_nothing(handlers, shortcuts, make_operations):
+    first = shortcuts.get_actions()["action_shortcuts"][0]
+    assert run(shortcuts, make_operations(first)).startswith("Action shortcut operation")
+    assert phrases(shortcuts) == ["üks", "kaks"]
+    assert index_errors(handlers) == []
+
+
+def test_audio_operations(handlers, upload):
+    audio = handlers["audio"]
+    created = run(audio, [AudioShortcutOperation(Op='create', Audio=UtteranceItem(Phrase="heli", FilePath=upload,
+                                                                                  Delay=0))])
+    assert handlers["media"].get_reference_count(upload) == 1
+    updated = UtteranceItem(ID=created[0], Phrase="heli 2", FilePath=upload, Delay=0)
+    assert run(audio, [AudioShortcutOperation(Op='update', Audio=updated)]) == []
+    assert [item.Phrase for item in audio.get_audio_metadata()["audio_shortcuts"]] == ["heli 2"]
+    assert run(audio, [AudioShortcutOperation(Op='delete', ID=created[0])]) == []
+    assert handlers["media"].get_reference_count(upload) == 0
+    assert index_errors(handlers) == []
+
+
+def test_audio_must_be_uploaded(handlers, upload, tmp_path):
+    (tmp_path / "elsewhere.wav").write_bytes(b"RIFF")
+    for file_path in [str(tmp_path / "elsewhere.wav"), str(tmp_path / "uploads" / "missing.wav"), "", None]:
+        operations = [AudioShortcutOperation(Op='create', Audio=UtteranceItem(Phrase="heli", FilePath=upload, Delay=0)),
+                      AudioShortcutOperation(Op='create', Audio=UtteranceItem(Phrase="x", FilePath=file_path, Delay=0))]
+        assert run(handlers["audio"], operations).startswith("Audio shortcut operation 1:")
+    assert handlers["audio"].get_audio_metadata()["audio_shortcuts"] == []
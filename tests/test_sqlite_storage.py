@@ -0,0 +1,68 @@
+import json
+from uuid import uuid4
+
+import pytest
+
+from data_handlers.sqlite_storage import SQLiteDatabase, SQLiteSessionStore, SQLiteCollectionStore, \
+    migrate_json_to_sqlite
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = SQLiteDatabase(str(tmp_path / "pepper.db"))
+    yield database
+    database.close()
+
+
+def stored_session(name, image=""):
+    return {"ID": str(uuid4()), "Name": name, "Description": "",
+            "Items": [{"ID": str(uuid4()), "Actions": [{"ID": str(uuid4()),
+                                                        "ImageItem": {"Name": "", "FilePath": image, "Delay": 0}}]}]}
+
+
+def test_sessions(database):
+    store = SQLiteSessionStore(database)
+    first = stored_session("Esimene", image="data/uploads/pilt.png")
+    second = stored_session("Teine")
+    store.save(first, 100.0)
+    store.save(second, 200.0)
+    assert store.get(first['ID']) == first
+    assert store.get(uuid4()) is None
+    assert store.summaries()[first['ID']] == {"Name": "Esimene", "Description": "", "ItemCount": 1,
+                                              "Modified": 100.0, "Media": ["data/uploads/pilt.png"],
+                                              "Items": [first['Items'][0]['ID']],
+                                              "Actions": [first['Items'][0]['Actions'][0]['ID']]}
+
+    first['Name'] = "Muudetud"
+    store.save(first, 300.0)
+    store.remove(second['ID'])
+    assert store.load_all() == [first]
+    assert list(store.summaries()) == [first['ID']]
+
+
+def test_collection_writes_only_changed_rows(database):
+    store = SQLiteCollectionStore(database, 'motions')
+    motions = [{"ID": str(uuid4()), "Name": name} for name in ["wave", "nod", "bow"]]
+    store.save(motions)
+    assert SQLiteCollectionStore(database, 'motions').load() == motions
+
+    writes = []
+    database.connection.set_trace_callback(writes.append)
+    store.save([motions[0], {**motions[2], "Name": "kummardus"}])
+    database.connection.set_trace_callback(None)
+    assert sum(statement.startswith("INSERT") for statement in writes) == 1
+    assert sum(statement.startswith("DELETE") for statement in writes) == 1
+    assert SQLiteCollectionStore(database, 'motions').load() == [motions[0], {**motions[2], "Name": "kummardus"}]
+
+
+def test_migration_leaves_the_json_files_alone(database, tmp_path):
+    legacy_file = tmp_path / "sessions.json"
+    legacy_file.write_text(json.dumps({"sessions": [stored_session("Vana")]}))
+    motions_file = tmp_path / "motions.json"
+    motions_file.write_text(json.dumps({"motions": [{"ID": str(uuid4()), "Name": "wave"}]}))
+
+    migrate_json_to_sqlite(database, str(tmp_path / "sessions"), str(legacy_file), {'motions': str(motions_file)})
+    assert [session['Name'] for session in SQLiteSessionStore(database).load_all()] == ["Vana"]
+    assert SQLiteCollectionStore(database, 'motions').load()[0]['Name'] == "wave"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["motions.json", "pepper.db", "pepper.db-shm",
+                                                               "pepper.db-wal", "sessions.json"]
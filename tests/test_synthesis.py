@@ -0,0 +1,90 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import pytest
+import requests
+
+from data_handlers import file_operations
+from data_handlers.file_operations import SynthesisError, synthesize, synthesize_batch, synthesis_filepath
+
+
+# Stands in for the Neurokõne session, answering with a short WAV-like body or failing for some phrases
+class FakeSynthesisSession:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self.lock = Lock()
+
+    def post(self, url, json=None, **kwargs):
+        with self.lock:
+            self.requests.append(json['text'])
+        time.sleep(self.delay)
+        return FakeResponse(json['text'])
+
+
+class FakeResponse:
+    def __init__(self, phrase):
+        self.phrase = phrase
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        if self.phrase == "refused":
+            raise requests.HTTPError("500 Server Error")
+
+    def iter_content(self, chunk_size):
+        yield b"RIFF"
+        if self.phrase == "interrupted":
+            raise requests.ConnectionError("Connection reset")
+        yield self.phrase.encode()
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "data" / "uploads")
+    monkeypatch.chdir(tmp_path)
+    fake = FakeSynthesisSession()
+    monkeypatch.setattr(file_operations, "_get_synthesis_session", lambda: fake)
+    monkeypatch.setattr(file_operations, "robot_audio", lambda filepath: filepath)
+    return fake
+
+
+def test_synthesis_is_cached(session):
+    filepath = synthesize("tere", "mari")
+    assert filepath == synthesis_filepath("tere", "mari")
+    assert synthesize("tere", "mari") == filepath
+    assert session.requests == ["tere"]
+    synthesize("tere", "mari", force=True)
+    assert session.requests == ["tere", "tere"]
+
+
+@pytest.mark.parametrize("phrase", ["refused", "interrupted"])
+def test_failed_synthesis_leaves_no_file(session, phrase):
+    with pytest.raises(SynthesisError):
+        synthesize(phrase, "mari")
+    assert os.listdir(os.path.join("data", "uploads")) == []
+
+
+def test_batch_synthesizes_each_triple_once(session):
+    session.delay = 0.2
+    triples = [("tere", "mari", 1.0), ("tere", "mari", 1.0), ("head aega", "mari", 1.0), ("refused", "mari", 1.0)]
+    finished = []
+    results = synthesize_batch(triples, on_result=lambda triple, result: finished.append(triple))
+    assert sorted(session.requests) == ["head aega", "refused", "tere"]
+    assert sorted(finished) == sorted(set(triples))
+    assert results[("tere", "mari", 1.0)] == synthesis_filepath("tere", "mari", 1.0)
+    assert isinstance(results[("refused", "mari", 1.0)], SynthesisError)
+
+
+def test_concurrent_synthesis_of_a_phrase_is_shared(session):
+    session.delay = 0.2
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        filepaths = list(executor.map(lambda _: synthesize("tere", "mari"), range(3)))
+    assert filepaths == [synthesis_filepath("tere", "mari")] * 3
+    assert session.requests == ["tere"]
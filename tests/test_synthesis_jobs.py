@@ -0,0 +1,70 @@
+import time
+from threading import Event
+
+import pytest
+
+import synthesisManager
+from data_handlers.file_operations import SynthesisError
+from synthesisManager import SynthesisManager
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    release = Event()
+
+    def synthesize_batch(triples, force=False, on_result=None):
+        release.wait(5)
+        results = {triple: SynthesisError("Refused") if triple[0] == "refused" else f"{triple[0]}.wav"
+                   for triple in triples}
+        for triple, result in results.items():
+            on_result(triple, result)
+        return results
+
+    monkeypatch.setattr(synthesisManager, "synthesize_batch", synthesize_batch)
+    manager = SynthesisManager()
+    manager.release = release
+    yield manager
+    release.set()
+    if manager.worker.is_alive():
+        manager.stop()
+
+
+def wait_until_running(manager, job_id):
+    for _ in range(500):
+        if manager.get_progress(job_id)["status"] != "queued":
+            return
+        time.sleep(0.01)
+
+
+def test_unattached_audio_is_reported(manager):
+    attached = []
+
+    def on_complete(file_paths):
+        attached.append(file_paths)
+        return ["changed"]
+
+    job_id = manager.submit({"kept": ("tere", "mari", 1.0), "changed": ("head aega", "mari", 1.0),
+                             "failed": ("refused", "mari", 1.0)}, on_complete)
+    wait_until_running(manager, job_id)
+    manager.release.set()
+    manager.stop()
+    assert attached == [{"kept": "tere.wav", "changed": "head aega.wav"}]
+    progress = manager.get_progress(job_id)
+    assert progress["status"] == "finished"
+    assert progress["items"] == {"kept": "done", "changed": "error", "failed": "error"}
+    assert set(progress["errors"]) == {"changed", "failed"}
+
+
+def test_stop_finishes_the_running_job_and_cancels_the_rest(manager):
+    completed = []
+    running = manager.submit({"a": ("tere", "mari", 1.0)}, lambda file_paths: completed.append(file_paths) or [])
+    queued = manager.submit({"b": ("head aega", "mari", 1.0)}, lambda file_paths: completed.append(file_paths) or [])
+    wait_until_running(manager, running)
+    # The running job is still synthesizing when the server shuts down
+    manager.stopping = True
+    manager.release.set()
+    manager.stop()
+    assert completed == [{"a": "tere.wav"}]
+    assert manager.get_progress(running)["items"] == {"a": "done"}
+    assert manager.get_progress(queued)["status"] == "finished"
+    assert manager.get_progress(queued)["items"] == {"b": "error"}
@@ -0,0 +1,44 @@
+import os
+import wave
+
+import pytest
+
+from data_handlers import variants
+from data_handlers.variants import robot_audio, robot_audio_path
+
+
+def write_wav(path, sample_rate=44100, channels=2, frames=4410):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(b"\x10\x00" * channels * frames)
+
+
+def test_robot_audio(tmp_path):
+    original = str(tmp_path / "speech.wav")
+    write_wav(original)
+    target = robot_audio(original)
+    assert target == robot_audio_path(original)
+    with wave.open(target, "rb") as f:
+        assert (f.getnchannels(), f.getsampwidth(), f.getframerate()) == (1, 2, variants.ROBOT_AUDIO_SAMPLE_RATE)
+    assert sorted(os.listdir(tmp_path)) == ["speech.wav", "speech_robot.wav"]
+
+
+def test_robot_audio_is_rebuilt_for_a_new_original(tmp_path):
+    original = str(tmp_path / "speech.wav")
+    write_wav(original)
+    target = robot_audio(original)
+    os.utime(target, (0, 0))
+    assert robot_audio(original) == target
+    assert os.path.getmtime(target) > 0
+
+
+def test_failed_variant_write_leaves_no_temporary_file(tmp_path):
+    def fail(f):
+        f.write(b"partial")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        variants._write_variant(str(tmp_path / "speech_robot.wav"), fail)
+    assert os.listdir(tmp_path) == []